@@ -18,9 +18,18 @@ app = Application()
 __all__ = ['app', 'HTTP_HOST', 'HTTP_PORT']
 
 # session middleware
-sess = Session(app, paths=['/cookies', '/invalid'])
+sess = Session(app, paths={
+    '/cookies': 'read-write',
+    '/invalid': 'read-write',
+    '/readonly': 'read-only',
+    '/norenew': 'no-renew',
+    '/cookies/skip': 'skip'
+})
 
 session_filepath = os.path.join(sess.path, '5e55')
+readonly_filepath = os.path.join(sess.path, 'f00d')
+norenew_filepath = os.path.join(sess.path, 'beef')
+compact_filepath = os.path.join(sess.path, 'c0de' * 8)
 
 
 @app.on_worker_start
@@ -33,6 +42,10 @@ async def worker_start(**_):
     with open(session_filepath + 'badf', 'w') as fp:
         fp.write('{badfile}')
 
+    for filepath in (readonly_filepath, norenew_filepath, compact_filepath):
+        with open(filepath, 'w') as fp:
+            json.dump({'foo': 'bar'}, fp)
+
 
 @app.route('/cookies')
 async def index(request, response, **_):
@@ -47,6 +60,27 @@ async def index(request, response, **_):
         yield b'OK'
 
 
+@app.route('/readonly')
+async def readonly(request, **_):
+    if request.ctx.session is None:
+        return b'None'
+
+    # will not be saved
+    request.ctx.session['baz'] = 'qux'
+    return request.ctx.session['foo']
+
+
+@app.route('/norenew')
+async def norenew(request, **_):
+    request.ctx.session['baz'] = 'qux'
+    return b'OK'
+
+
+@app.route('/cookies/skip')
+async def skip(request, **_):
+    return repr(request.ctx.session)
+
+
 @app.on_response
 async def response_middleware(request, response, **_):
     session = request.ctx.session
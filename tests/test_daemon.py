@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+import asyncio
+import multiprocessing as mp
+import os
+import signal
+import sys
+import tempfile
+import time
+import unittest
+
+# makes imports relative from the repo directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tremolo_session import DaemonStore, MemoryStore  # noqa: E402
+from tremolo_session.__main__ import main  # noqa: E402
+from tremolo_session.daemon import SessionServer  # noqa: E402
+
+
+@unittest.skipUnless(hasattr(asyncio, 'start_unix_server'),
+                     'requires Unix sockets')
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        print('\r\n[', self.id(), ']')
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'sess.sock')
+        self.snapshot = os.path.join(self.tmp.name, 'sess.snapshot')
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+        self.tmp.cleanup()
+
+    def run_until_complete(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def test_store(self):
+        server = SessionServer(self.path)
+        store = DaemonStore(self.path, pool_size=2)
+        self.run_until_complete(server.start())
+
+        try:
+            expires = time.time() + 60
+            self.run_until_complete(store.set('5e55', b'{"foo": "bar"}',
+                                              expires))
+            self.run_until_complete(store.set('ba55', b'{}'))
+
+            self.assertTrue(self.run_until_complete(store.exists('5e55')))
+            self.assertEqual(self.run_until_complete(store.get('5e55')),
+                             b'{"foo": "bar"}')
+            self.assertEqual(self.run_until_complete(store.expiry('5e55')),
+                             expires)
+            self.assertEqual(
+                sorted(self.run_until_complete(store.keys())),
+                ['5e55', 'ba55']
+            )
+
+            self.assertTrue(self.run_until_complete(store.touch('ba55',
+                                                                expires)))
+            self.assertEqual(self.run_until_complete(store.expiry('ba55')),
+                             expires)
+            self.assertFalse(self.run_until_complete(store.touch('f00d')))
+
+            self.run_until_complete(store.delete('5e55'))
+            self.assertIsNone(self.run_until_complete(store.get('5e55')))
+            self.assertFalse(self.run_until_complete(store.exists('5e55')))
+            self.assertEqual(oct(os.stat(self.path).st_mode & 0o777),
+                             oct(0o600))
+        finally:
+            self.run_until_complete(store.stop())
+            self.run_until_complete(server.stop())
+
+    def test_pipeline(self):
+        server = SessionServer(self.path)
+        store = DaemonStore(self.path, pool_size=2)
+        self.run_until_complete(server.start())
+
+        try:
+            self.run_until_complete(asyncio.gather(*(
+                store.set('%04x' % i, b'{"i": %d}' % i) for i in range(100)
+            )))
+            values = self.run_until_complete(asyncio.gather(*(
+                store.get('%04x' % i) for i in range(100)
+            )))
+
+            self.assertEqual(values,
+                             [b'{"i": %d}' % i for i in range(100)])
+            self.assertEqual(len(store.connections), 2)
+        finally:
+            self.run_until_complete(store.stop())
+            self.run_until_complete(server.stop())
+
+    def test_reconnect(self):
+        server = SessionServer(self.path,
+                               MemoryStore(snapshot=self.snapshot))
+        store = DaemonStore(self.path, pool_size=1)
+        self.run_until_complete(server.start())
+
+        try:
+            self.run_until_complete(store.set('5e55', b'{}'))
+            self.run_until_complete(server.stop())
+
+            with self.assertRaises(OSError):
+                self.run_until_complete(store.get('5e55'))
+
+            # restarted from the snapshot
+            server = SessionServer(self.path,
+                                   MemoryStore(snapshot=self.snapshot))
+            self.run_until_complete(server.start())
+
+            self.assertEqual(self.run_until_complete(store.get('5e55')),
+                             b'{}')
+        finally:
+            self.run_until_complete(store.stop())
+            self.run_until_complete(server.stop())
+
+    def test_cli_serve(self):
+        p = mp.get_context('spawn').Process(
+            target=main,
+            args=(['serve', self.path, '--snapshot', self.snapshot],)
+        )
+        p.start()
+
+        try:
+            deadline = time.monotonic() + 10
+
+            while (not os.path.exists(self.path) and
+                    time.monotonic() < deadline):
+                time.sleep(0.05)
+
+            store = DaemonStore(self.path)
+            self.run_until_complete(store.set('5e55', b'{}'))
+            self.run_until_complete(store.stop())
+        finally:
+            os.kill(p.pid, signal.SIGTERM)
+            p.join()
+
+        self.assertEqual(p.exitcode, 0)
+        self.assertFalse(os.path.exists(self.path))
+
+        with open(self.snapshot) as fp:
+            self.assertIn('"5e55"', fp.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
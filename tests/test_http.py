@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 
+import base64
 import multiprocessing as mp
+import json
 import os
+import re
 import signal
 import sys
 import time
@@ -12,6 +15,8 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from tests.http_server import (  # noqa: E402
     app,
+    norenew_filepath,
+    readonly_filepath,
     HTTP_HOST,
     HTTP_PORT
 )
@@ -45,6 +50,19 @@ class TestHTTP(unittest.TestCase):
             self.assertTrue(b'\r\nCache-Control: no-cache,' in body)
             self.assertTrue(b'\r\nSet-Cookie: sess=' in body)
 
+    def test_get_setcookie(self):
+        with self.client:
+            response = self.client.send(b'GET /cookies HTTP/1.0')
+            body = response.body()
+
+            self.assertEqual(response.status, 200)
+            self.assertTrue(
+                re.search(rb'\r\nSet-Cookie: sess=[0-9a-f]{64}\.[0-9]+; '
+                          rb'expires=[A-Z][a-z]{2}, [0-9]{2} [A-Z][a-z]{2} '
+                          rb'[0-9]{4} [0-9:]{8} GMT; max-age=34560000; '
+                          rb'path=/(\r\n|$)', body)
+            )
+
     def test_get_ok(self):
         with self.client:
             response = self.client.send(
@@ -78,6 +96,68 @@ class TestHTTP(unittest.TestCase):
             self.assertEqual(response.message, b'OK')
             self.assertEqual(response.body(), b'OK')
 
+    def test_get_readonly(self):
+        with self.client:
+            response = self.client.send(
+                b'GET /readonly HTTP/1.0',
+                b'Cookie: sess=f00d.%d' % _EXPIRES
+            )
+
+            self.assertEqual(response.status, 200)
+            self.assertEqual(response.body(), b'bar')
+            self.assertTrue(b'cache-control' in response.headers)
+            self.assertFalse(b'set-cookie' in response.headers)
+
+        with open(readonly_filepath, 'r') as fp:
+            self.assertEqual(json.load(fp), {'foo': 'bar'})
+
+    def test_get_readonly_compact(self):
+        cookie = base64.urlsafe_b64encode(
+            b'\x01' + bytes.fromhex('c0de' * 8) +
+            int(_EXPIRES).to_bytes(4, 'big')
+        )
+
+        with self.client:
+            response = self.client.send(b'GET /readonly HTTP/1.0',
+                                        b'Cookie: sess=' + cookie)
+
+            self.assertEqual(response.status, 200)
+            self.assertEqual(response.body(), b'bar')
+
+    def test_get_readonly_nocookie(self):
+        with self.client:
+            response = self.client.send(b'GET /readonly HTTP/1.0')
+
+            self.assertEqual(response.status, 200)
+            self.assertEqual(response.body(), b'None')
+            self.assertFalse(b'set-cookie' in response.headers)
+
+    def test_get_norenew(self):
+        with self.client:
+            response = self.client.send(
+                b'GET /norenew HTTP/1.0',
+                b'Cookie: sess=beef.%d' % _EXPIRES
+            )
+
+            self.assertEqual(response.status, 200)
+            self.assertEqual(response.body(), b'OK')
+            self.assertFalse(b'set-cookie' in response.headers)
+
+        with open(norenew_filepath, 'r') as fp:
+            self.assertEqual(json.load(fp), {'foo': 'bar', 'baz': 'qux'})
+
+    def test_get_skip(self):
+        with self.client:
+            response = self.client.send(
+                b'GET /cookies/skip HTTP/1.0',
+                b'Cookie: sess=beef.%d' % _EXPIRES
+            )
+
+            self.assertEqual(response.status, 200)
+            self.assertEqual(response.body(), b'None')
+            self.assertFalse(b'cache-control' in response.headers)
+            self.assertFalse(b'set-cookie' in response.headers)
+
     def test_get_notfound(self):
         with self.client:
             response = self.client.send(b'GET /invalid HTTP/1.1')
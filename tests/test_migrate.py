@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+import asyncio
+import io
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+# makes imports relative from the repo directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tremolo_session import (  # noqa: E402
+    FileStore,
+    MemoryStore,
+    MigrationStore
+)
+from tremolo_session import migrate  # noqa: E402
+from tremolo_session.__main__ import main  # noqa: E402
+
+
+class TestMigrate(unittest.TestCase):
+    def setUp(self):
+        print('\r\n[', self.id(), ']')
+
+        self.loop = asyncio.new_event_loop()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self.tmp.name, 'src')
+        self.dst = os.path.join(self.tmp.name, 'dst')
+        os.mkdir(self.src)
+        os.mkdir(self.dst)
+
+    def tearDown(self):
+        self.loop.close()
+        self.tmp.cleanup()
+
+    def run_until_complete(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def test_copy_keeps_ttl(self):
+        src = MemoryStore()
+        dst = MemoryStore()
+        expires = time.time() + 60
+
+        src.set('5e55', b'{"foo": "bar"}', expires)
+        src.set('ba55', b'{}', 1)  # expired
+        dst.set('c0de', b'{"new": 1}')
+        src.set('c0de', b'{"old": 1}')
+
+        self.assertEqual(
+            self.run_until_complete(migrate.copy(src, dst, batch_size=1)), 1
+        )
+        self.assertEqual(dst.get('5e55'), b'{"foo": "bar"}')
+        self.assertEqual(dst.expiry('5e55'), expires)
+        self.assertIsNone(dst.get('ba55'))
+        self.assertEqual(dst.get('c0de'), b'{"new": 1}')
+
+    def test_export_import(self):
+        src = FileStore(self.src)
+        dst = FileStore(self.dst)
+
+        for i in range(5):
+            src.set('%02x' % i, b'{"i": %d}' % i)
+
+        fp = io.StringIO()
+        self.assertEqual(
+            self.run_until_complete(migrate.export(src, fp, batch_size=2)), 5
+        )
+
+        fp.seek(0)
+        self.assertEqual(
+            self.run_until_complete(migrate.import_(dst, fp, ttl=60)), 5
+        )
+        self.assertEqual(dst.get('04'), b'{"i": 4}')
+
+    def test_cli_copy(self):
+        FileStore(self.src).set('5e55', b'{}')
+
+        main(['copy', '--from', self.src, '--to', self.dst + '=2',
+              '--delete', '--batch-size', '10', '--ttl', '60',
+              '--overwrite'])
+
+        self.assertEqual(os.listdir(self.src), [])
+        self.assertEqual(os.listdir(self.dst), ['5e55'])
+
+    def test_migration_store(self):
+        old = FileStore(self.src)
+        new = MemoryStore()
+        store = MigrationStore(old, new)
+
+        old.set('5e55', b'{"foo": "bar"}')
+
+        self.assertEqual(self.run_until_complete(store.get('5e55')),
+                         b'{"foo": "bar"}')
+        self.assertEqual(new.get('5e55'), b'{"foo": "bar"}')
+
+        self.run_until_complete(store.set('ba55', b'{}'))
+        self.assertTrue(old.exists('ba55') and new.exists('ba55'))
+
+        self.run_until_complete(store.delete('5e55'))
+        self.assertFalse(self.run_until_complete(store.exists('5e55')))
+
+
+if __name__ == '__main__':
+    unittest.main()
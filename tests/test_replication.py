@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+import asyncio
+import multiprocessing as mp
+import os
+import socket
+import sys
+import tempfile
+import time
+import unittest
+
+# makes imports relative from the repo directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tremolo_session import (  # noqa: E402
+    FileStore,
+    MemoryStore,
+    ReplicatedStore
+)
+from tremolo_session.replication import (  # noqa: E402
+    _LENGTH,
+    _SEQ,
+    OP_HELLO,
+    unpack_record
+)
+
+
+class SlowPeer:
+    def __init__(self):
+        self.data = bytearray()
+
+    async def readexactly(self, n):
+        return _SEQ.pack(0)
+
+    def write(self, data):
+        self.data.extend(data)
+
+    async def drain(self):
+        await asyncio.sleep(0.01)
+
+    def records(self):
+        records = []
+        offset = 0
+
+        while offset < len(self.data):
+            length, = _LENGTH.unpack_from(self.data, offset)
+            offset += _LENGTH.size
+            payload = bytes(self.data[offset:offset + length])
+            offset += length
+
+            if payload[:1] != OP_HELLO:
+                records.append(unpack_record(payload))
+
+        return records
+
+
+def get_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run_node(path, port, seconds):
+    loop = asyncio.new_event_loop()
+    store = ReplicatedStore(FileStore(path), listen=('127.0.0.1', port))
+
+    loop.run_until_complete(store.start(loop))
+    loop.run_until_complete(asyncio.sleep(seconds))
+    loop.run_until_complete(store.stop())
+    loop.close()
+
+
+class TestReplication(unittest.TestCase):
+    def setUp(self):
+        print('\r\n[', self.id(), ']')
+
+        self.loop = asyncio.new_event_loop()
+        self.port = get_port()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_until_complete(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def wait_for(self, func, timeout=5):
+        deadline = time.monotonic() + timeout
+
+        while not func() and time.monotonic() < deadline:
+            self.run_until_complete(asyncio.sleep(0.01))
+
+        return func()
+
+    def test_replicate(self):
+        a = ReplicatedStore(MemoryStore(), peers=[('127.0.0.1', self.port)],
+                            reconnect_delay=0.05)
+        b = ReplicatedStore(MemoryStore(), listen=('127.0.0.1', self.port),
+                            peers=[])
+
+        self.run_until_complete(b.start(self.loop))
+        self.run_until_complete(a.start(self.loop))
+
+        try:
+            a.set('5e55', b'{"foo": "bar"}', time.time() + 60)
+            a.set('ba55', b'{}')
+
+            self.assertTrue(self.wait_for(lambda: b.get('ba55') == b'{}'))
+            self.assertEqual(b.get('5e55'), b'{"foo": "bar"}')
+            self.assertEqual(b.applied[a.node_id], 2)
+
+            a.delete('5e55')
+            self.assertTrue(self.wait_for(lambda: b.get('5e55') is None))
+
+            # not published back
+            self.assertEqual(b.seq, 0)
+        finally:
+            self.run_until_complete(a.stop())
+            self.run_until_complete(b.stop())
+
+    def test_catch_up(self):
+        a = ReplicatedStore(MemoryStore(), peers=[('127.0.0.1', self.port)],
+                            reconnect_delay=0.05, log_size=2)
+        b = ReplicatedStore(MemoryStore(), listen=('127.0.0.1', self.port))
+
+        self.run_until_complete(a.start(self.loop))
+
+        try:
+            for i in range(4):
+                a.set('%02x' % i, b'{}')
+
+            # the peer is late, and the log only has the last 2 records
+            self.run_until_complete(b.start(self.loop))
+
+            self.assertTrue(self.wait_for(lambda: len(b.keys()) == 4))
+            self.assertEqual(b.applied[a.node_id], 4)
+        finally:
+            self.run_until_complete(a.stop())
+            self.run_until_complete(b.stop())
+
+    def test_slow_peer(self):
+        a = ReplicatedStore(MemoryStore(), log_size=10, batch_size=5)
+        peer = SlowPeer()
+        event = asyncio.Event()
+
+        async def write():
+            for i in range(40):
+                a.set('%02x' % i, b'{}')
+                event.set()
+
+                if i % 10 == 9:
+                    await asyncio.sleep(0.005)
+
+        async def replicate():
+            task = self.loop.create_task(a._send(peer, peer, event))
+            await write()
+            await asyncio.sleep(0.2)
+            task.cancel()
+
+        self.run_until_complete(replicate())
+
+        # the records that have left the log meanwhile are resynced
+        self.assertEqual(
+            sorted({record[3] for record in peer.records()}),
+            ['%02x' % i for i in range(40)]
+        )
+
+    def test_one_listener(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for listen in (('127.0.0.1', self.port),
+                           os.path.join(tmp, 'repl.sock')):
+                # two workers of a node
+                a = ReplicatedStore(FileStore(tmp), listen=listen,
+                                    reconnect_delay=0.05)
+                b = ReplicatedStore(FileStore(tmp), listen=listen,
+                                    reconnect_delay=0.05)
+
+                self.run_until_complete(a.start(self.loop))
+                self.run_until_complete(b.start(self.loop))
+
+                try:
+                    self.assertIsNotNone(a._server)
+                    self.assertIsNone(b._server)
+
+                    # takes over
+                    self.run_until_complete(a.stop())
+                    self.assertTrue(
+                        self.wait_for(lambda: b._server is not None)
+                    )
+                finally:
+                    self.run_until_complete(b.stop())
+
+    def test_processes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            p = mp.get_context('spawn').Process(
+                target=run_node, args=(tmp, self.port, 10)
+            )
+            p.start()
+
+            a = ReplicatedStore(MemoryStore(),
+                                peers=[('127.0.0.1', self.port)],
+                                reconnect_delay=0.1)
+            self.run_until_complete(a.start(self.loop))
+
+            try:
+                a.set('5e55', b'{"foo": "bar"}')
+
+                self.assertTrue(self.wait_for(
+                    lambda: os.path.exists(os.path.join(tmp, '5e55')),
+                    timeout=10
+                ))
+            finally:
+                self.run_until_complete(a.stop())
+                p.terminate()
+                p.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
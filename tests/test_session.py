@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+# makes imports relative from the repo directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tremolo import Application  # noqa: E402
+from tremolo.lib.contexts import (  # noqa: E402
+    ConnectionContext,
+    RequestContext
+)
+from tremolo_session import (  # noqa: E402
+    MemoryStore,
+    Session,
+    SessionData,
+    TieredStore,
+    parse_cookie
+)
+
+
+class SlowStore(MemoryStore):
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    async def get(self, session_id):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+
+        if session_id == 'bad':
+            raise OSError('I/O error')
+
+        return super().get(session_id)
+
+
+class TestSession(unittest.TestCase):
+    def setUp(self):
+        print('\r\n[', self.id(), ']')
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        self.store = SlowStore()
+        self.session = Session(Application(), store=self.store)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_single_flight(self):
+        self.store.set('5e55', b'{"foo": "bar"}')
+
+        values = self.loop.run_until_complete(asyncio.gather(
+            *(self.session._load('5e55') for _ in range(5))
+        ))
+
+        self.assertEqual(values, [b'{"foo": "bar"}'] * 5)
+        self.assertEqual(self.store.calls, 1)
+        self.assertEqual(self.session._loading, {})
+
+    def test_single_flight_error(self):
+        results = self.loop.run_until_complete(asyncio.gather(
+            *(self.session._load('bad') for _ in range(3)),
+            return_exceptions=True
+        ))
+
+        self.assertTrue(all(isinstance(exc, OSError) for exc in results))
+        self.assertEqual(self.store.calls, 3)
+
+    def test_connection_reuse(self):
+        context = ConnectionContext()
+        self.store.set('5e55', b'{"foo": "bar"}')
+
+        for _ in range(3):
+            self.assertEqual(
+                self.loop.run_until_complete(
+                    self.session._load_cached(context, '5e55')
+                ),
+                b'{"foo": "bar"}'
+            )
+
+        self.assertEqual(self.store.calls, 1)
+
+        # written by another request
+        self.store.set('5e55', b'{"foo": "baz"}')
+
+        self.assertEqual(
+            self.loop.run_until_complete(
+                self.session._load_cached(context, '5e55')
+            ),
+            b'{"foo": "baz"}'
+        )
+        self.assertEqual(self.store.calls, 2)
+
+        self.store.delete('5e55')
+
+        self.assertIsNone(self.loop.run_until_complete(
+            self.session._load_cached(context, '5e55')
+        ))
+        self.assertFalse('session_sess' in context)
+
+
+class Request:
+    def __init__(self, cookie=None):
+        self.path = b'/'
+        self.cookies = {'sess': [cookie]} if cookie else {}
+        self.ctx = RequestContext()
+        self.server = self
+        self.context = ConnectionContext()
+
+    def uid(self, length=32):
+        return os.urandom(length)
+
+
+class Response:
+    def __init__(self):
+        self.headers = []
+
+    def append_header(self, name, value):
+        self.headers.append((name, value))
+
+    def set_header(self, name, value):
+        self.headers.append((name, value))
+
+
+class TestSessionData(unittest.TestCase):
+    def setUp(self):
+        print('\r\n[', self.id(), ']')
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_renew_unmodified(self):
+        store = MemoryStore()
+        session = Session(Application(), store=store, expires=2)
+        session_id = '%064x' % 0x5e55
+
+        # an active session, never modified after it was created
+        for _ in range(3):
+            store.set(session_id, b'{"foo": "bar"}', time.time() + 0.5)
+            request = Request('%s.%d' % (session_id, time.time() + 1))
+
+            self.loop.run_until_complete(
+                session._on_request(request, Response())
+            )
+            self.loop.run_until_complete(session._on_response(request))
+
+            self.assertEqual(request.ctx.session.id, session_id)
+            self.assertGreater(store.expiry(session_id), time.time() + 1)
+
+    def test_volumes(self):
+        with self.assertRaises(FileNotFoundError):
+            Session(Application(), path={'/nonexistent/ssd0/sess': 1,
+                                         '/nonexistent/ssd1/sess': 2})
+
+        with tempfile.TemporaryDirectory() as a, \
+                tempfile.TemporaryDirectory() as b:
+            session = Session(Application(), path={a: 1, b: 2})
+            self.assertEqual(session.store.volumes, [(a, 1), (b, 2)])
+
+    def test_unawaited(self):
+        store = TieredStore(MemoryStore())
+        data = SessionData('sess', '5e55', {}, store, None, time.time() + 60)
+        data['foo'] = 'bar'
+
+        data.save()
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.assertTrue(self.loop.run_until_complete(store.exists('5e55')))
+
+        data.delete()
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.assertFalse(self.loop.run_until_complete(store.exists('5e55')))
+        self.assertIsNone(data.filepath)
+
+
+class TestCookieFormat(unittest.TestCase):
+    def setUp(self):
+        print('\r\n[', self.id(), ']')
+
+        self.session = Session(Application(), store=MemoryStore(),
+                               cookie_format='compact')
+
+    def test_compact(self):
+        response = Response()
+        expires = self.session._set_cookie(response, '%032x' % 0x5e55)
+        name, value = response.headers[0]
+        value = value[len(b'sess='):value.index(b';')]
+
+        self.assertEqual(name, b'Set-Cookie')
+        self.assertEqual(len(value), 28)
+        self.assertEqual(parse_cookie(value.decode('latin-1')),
+                         ('%032x' % 0x5e55, expires))
+
+    def test_legacy(self):
+        response = Response()
+        expires = self.session._set_cookie(response, '%064x' % 0x5e55)
+        value = response.headers[0][1]
+
+        self.assertTrue(value.startswith(b'sess=%064x.%d;' % (0x5e55,
+                                                              expires)))
+        self.assertEqual(parse_cookie('5e55.%d' % expires),
+                         ('5e55', expires))
+
+    def test_bad_cookie(self):
+        for value in ('A' * 28, '!' * 28, 'xx.0', 'é' * 28, ''):
+            with self.assertRaises(ValueError):
+                parse_cookie(value)
+
+        with self.assertRaises(ValueError):
+            Session(Application(), store=MemoryStore(), cookie_format='b64')
+
+
+if __name__ == '__main__':
+    unittest.main()
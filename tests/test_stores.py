@@ -0,0 +1,727 @@
+#!/usr/bin/env python3
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+# makes imports relative from the repo directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tremolo_session import (  # noqa: E402
+    BloomFilterStore,
+    BreakerStore,
+    FileStore,
+    MemoryStore,
+    TieredStore
+)
+from tremolo_session import inotify  # noqa: E402
+from tremolo_session.bloom import BloomFilter  # noqa: E402
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class CountingStore(MemoryStore):
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def get(self, session_id):
+        self.calls += 1
+        return super().get(session_id)
+
+    def version(self, session_id):
+        self.calls += 1
+        return super().version(session_id)
+
+
+class TestTieredStore(unittest.TestCase):
+    def setUp(self):
+        print('\r\n[', self.id(), ']')
+
+        self.loop = asyncio.new_event_loop()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.memory = MemoryStore()
+        self.files = FileStore(self.tmp.name)
+
+    def tearDown(self):
+        self.loop.close()
+        self.tmp.cleanup()
+
+    def run_until_complete(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def test_read_through_promotes(self):
+        store = TieredStore(self.memory, self.files)
+        self.files.set('5e55', b'{"foo": "bar"}')
+
+        self.assertEqual(self.run_until_complete(store.get('5e55')),
+                         b'{"foo": "bar"}')
+        self.assertEqual(self.memory.get('5e55'), b'{"foo": "bar"}')
+        self.assertIsNone(self.run_until_complete(store.get('ba55')))
+
+    def test_promote_expiry(self):
+        store = TieredStore(self.memory, self.files, promote_ttl=60)
+        self.files.set('5e55', b'{}')
+
+        self.run_until_complete(store.get('5e55'))
+        self.assertAlmostEqual(self.memory.expiry('5e55'), time.time() + 60,
+                               delta=5)
+
+    def test_write_around(self):
+        store = TieredStore((self.memory, 'write-around'), self.files)
+        self.memory.set('5e55', b'{}')
+        self.run_until_complete(store.set('5e55', b'{"foo": "bar"}'))
+
+        self.assertIsNone(self.memory.get('5e55'))
+        self.assertEqual(self.files.get('5e55'), b'{"foo": "bar"}')
+
+    def test_write_back(self):
+        store = TieredStore(self.memory, (self.files, 'write-back'))
+        self.run_until_complete(store.set('5e55', b'{"foo": "bar"}'))
+
+        self.assertIsNone(self.files.get('5e55'))
+        self.assertTrue(self.run_until_complete(store.exists('5e55')))
+
+        self.run_until_complete(store.flush())
+        self.assertEqual(self.files.get('5e55'), b'{"foo": "bar"}')
+
+        self.run_until_complete(store.delete('5e55'))
+        self.assertIsNone(self.run_until_complete(store.get('5e55')))
+        self.assertTrue(self.files.exists('5e55'))
+
+        self.run_until_complete(store.stop())
+        self.assertFalse(self.files.exists('5e55'))
+
+    def test_write_back_retry(self):
+        flaky = FlakyStore()
+        store = TieredStore(self.memory, (flaky, 'write-back'),
+                            flush_interval=0.01)
+        self.run_until_complete(store.start(self.loop))
+
+        try:
+            flaky.down = True
+            self.run_until_complete(store.set('aa', b'{}'))
+
+            with self.assertLogs('tremolo_session.stores', 'ERROR'):
+                self.run_until_complete(asyncio.sleep(0.05))
+
+            self.assertIn('aa', store.tiers[1][2])
+
+            flaky.down = False
+            self.run_until_complete(store.set('bb', b'{}'))
+            self.run_until_complete(asyncio.sleep(0.05))
+
+            self.assertEqual(sorted(flaky.keys()), ['aa', 'bb'])
+        finally:
+            self.run_until_complete(store.stop())
+
+    def test_invalidate(self):
+        store = TieredStore(self.memory, self.files)
+        self.run_until_complete(store.set('5e55', b'{"foo": "bar"}'))
+        self.run_until_complete(store.invalidate('5e55'))
+
+        self.assertIsNone(self.memory.get('5e55'))
+        self.assertTrue(self.files.exists('5e55'))
+
+        self.run_until_complete(store.get('5e55'))
+        self.run_until_complete(store.invalidate(tier=0))
+        self.assertEqual(self.memory.data, {})
+
+    def test_warm_up(self):
+        for i in range(5):
+            self.files.set('%02x' % i, b'{"i": %d}' % i)
+            os.utime(self.files.filepath('%02x' % i), (i, i))
+
+        tmp = tempfile.TemporaryDirectory()
+        hot_ids = os.path.join(tmp.name, 'hot-ids')
+        store = TieredStore(self.memory, self.files, warm_up=3,
+                            hot_ids=hot_ids)
+
+        self.assertEqual(
+            self.run_until_complete(store.load_recent(self.loop)), 3
+        )
+        self.assertEqual(sorted(self.memory.keys()), ['02', '03', '04'])
+
+        self.memory.clear()
+        self.memory.set('00', b'{}')
+        self.run_until_complete(store.stop())
+
+        with open(hot_ids, 'r') as fp:
+            self.assertEqual(fp.read().split(), ['00'])
+
+        # hot ids first, then the most recent files
+        self.memory.clear()
+        self.run_until_complete(store.load_recent(self.loop))
+        self.assertEqual(sorted(self.memory.keys()), ['00', '03', '04'])
+        tmp.cleanup()
+
+        store = TieredStore(self.memory, self.files, warm_up=5,
+                            warm_up_bytes=16)
+        self.memory.clear()
+        self.assertEqual(
+            self.run_until_complete(store.load_recent(self.loop)), 2
+        )
+
+    @unittest.skipUnless(inotify.available(), 'requires Linux inotify')
+    def test_watch(self):
+        store = TieredStore(self.memory, self.files, watch=True)
+        other = FileStore(self.tmp.name)  # e.g. another worker
+
+        self.run_until_complete(store.start(self.loop))
+
+        try:
+            self.run_until_complete(store.set('5e55', b'{"foo": "bar"}'))
+            self.run_until_complete(asyncio.sleep(0.05))
+
+            # own writes don't invalidate
+            self.assertEqual(self.memory.get('5e55'), b'{"foo": "bar"}')
+            self.assertEqual(store._writes, {1: {}})
+
+            other.set('5e55', b'{"foo": "baz"}')
+            self.run_until_complete(asyncio.sleep(0.05))
+
+            self.assertIsNone(self.memory.get('5e55'))
+            self.assertEqual(self.run_until_complete(store.get('5e55')),
+                             b'{"foo": "baz"}')
+
+            other.delete('5e55')
+            self.run_until_complete(asyncio.sleep(0.05))
+
+            self.assertIsNone(self.memory.get('5e55'))
+
+            # stray files are ignored, the events after them are not
+            self.run_until_complete(store.set('5e55', b'{}'))
+            self.run_until_complete(asyncio.sleep(0.05))
+
+            with open(os.path.join(self.tmp.name, '.5e55.swp'), 'w'):
+                pass
+
+            other.set('5e55', b'{"foo": "qux"}')
+            self.run_until_complete(asyncio.sleep(0.05))
+
+            self.assertIsNone(self.memory.get('5e55'))
+        finally:
+            self.run_until_complete(store.stop())
+
+    @unittest.skipUnless(inotify.available(), 'requires Linux inotify')
+    def test_watch_merged(self):
+        store = TieredStore(self.memory, self.files, watch=True)
+        other = FileStore(self.tmp.name)
+
+        async def save_twice():
+            # the watcher doesn't run in between
+            await store.set('5e55', b'{"n": 1}')
+            await store.set('5e55', b'{"n": 2}')
+
+        self.run_until_complete(store.start(self.loop))
+
+        try:
+            self.run_until_complete(save_twice())
+            self.run_until_complete(asyncio.sleep(0.05))
+            self.assertEqual(self.memory.get('5e55'), b'{"n": 2}')
+
+            other.set('5e55', b'{"n": 3}')
+            self.run_until_complete(asyncio.sleep(0.05))
+
+            self.assertEqual(self.run_until_complete(store.get('5e55')),
+                             b'{"n": 3}')
+        finally:
+            self.run_until_complete(store.stop())
+
+    @unittest.skipUnless(inotify.available(), 'requires Linux inotify')
+    def test_watch_overflow(self):
+        bloom = BloomFilterStore(self.files)
+        store = TieredStore(self.memory, bloom, watch=True)
+
+        self.run_until_complete(store.start(self.loop))
+
+        try:
+            self.assertNotIn('5e55', bloom)
+
+            # the events of a file created meanwhile are lost
+            store._watcher.stop()
+            store._watcher = None
+            FileStore(self.tmp.name).set('5e55', b'{}')
+            store._on_change(None, None, inotify.IN_Q_OVERFLOW)
+            self.run_until_complete(asyncio.sleep(0.05))
+
+            self.assertIn('5e55', bloom)
+        finally:
+            self.run_until_complete(store.stop())
+
+    def test_bad_policy(self):
+        with self.assertRaises(ValueError):
+            TieredStore((self.memory, 'write-anywhere'), self.files)
+
+        with self.assertRaises(ValueError):
+            TieredStore(self.memory, (self.files, 'write-around'))
+
+
+class FlakyStore(MemoryStore):
+    def __init__(self):
+        super().__init__()
+        self.down = False
+        self.delay = 0
+
+    def _check(self):
+        time.sleep(self.delay)
+
+        if self.down:
+            raise OSError('No space left on device')
+
+    def get(self, session_id):
+        self._check()
+        return super().get(session_id)
+
+    def set(self, session_id, value, expires=None):
+        self._check()
+        super().set(session_id, value, expires)
+
+
+class TestBreakerStore(unittest.TestCase):
+    def setUp(self):
+        print('\r\n[', self.id(), ']')
+
+        self.loop = asyncio.new_event_loop()
+        self.inner = FlakyStore()
+        self.store = BreakerStore(self.inner, timeout=0.1, threshold=2,
+                                  reset_timeout=0.1)
+        self.loop.run_until_complete(self.store.start(self.loop))
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.store.stop())
+        self.loop.close()
+
+    def run_until_complete(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def test_trip_and_recover(self):
+        self.run_until_complete(self.store.set('5e55', b'{"a": 1}'))
+        self.inner.down = True
+
+        for _ in range(2):
+            self.run_until_complete(self.store.set('5e55', b'{"a": 2}'))
+
+        self.assertEqual(self.store.health()['state'], 'open')
+        self.assertEqual(self.store.trips, 1)
+        self.assertEqual(len(self.store.buffer), 1)
+
+        # served from the buffer
+        self.assertEqual(self.run_until_complete(self.store.get('5e55')),
+                         b'{"a": 2}')
+
+        self.inner.down = False
+        self.run_until_complete(asyncio.sleep(0.1))
+
+        # the probe closes the breaker and replays the buffer
+        self.assertIsNone(self.run_until_complete(self.store.get('ba55')))
+        self.assertEqual(self.store.state, 'closed')
+        self.run_until_complete(asyncio.sleep(0.05))
+        self.assertEqual(self.inner.get('5e55'), b'{"a": 2}')
+        self.assertEqual(len(self.store.buffer), 0)
+
+    def test_timeout(self):
+        self.inner.set('5e55', b'{}')
+        self.run_until_complete(self.store.get('5e55'))
+        self.inner.delay = 0.2
+
+        for _ in range(2):
+            # degraded reads from the cache
+            self.assertEqual(self.run_until_complete(self.store.get('5e55')),
+                             b'{}')
+
+        self.assertEqual(self.store.state, 'open')
+
+        self.inner.delay = 0
+        self.inner.down = True
+        self.run_until_complete(asyncio.sleep(0.1))
+        self.run_until_complete(self.store.get('5e55'))
+
+        # the probe has failed
+        self.assertEqual(self.store.state, 'open')
+        self.assertEqual(self.store.trips, 2)
+
+    def test_probe_cancelled(self):
+        self.inner.down = True
+
+        for _ in range(2):
+            self.run_until_complete(self.store.get('5e55'))
+
+        self.inner.down = False
+        self.inner.delay = 0.05
+        self.run_until_complete(asyncio.sleep(0.1))
+
+        # e.g. the client has disconnected
+        task = self.loop.create_task(self.store.get('5e55'))
+        self.run_until_complete(asyncio.sleep(0.01))
+        task.cancel()
+        self.run_until_complete(asyncio.gather(task, return_exceptions=True))
+
+        self.assertEqual(self.store.state, 'open')
+
+        self.inner.set('5e55', b'{}')
+        self.assertEqual(self.run_until_complete(self.store.get('5e55')),
+                         b'{}')
+        self.assertEqual(self.store.state, 'closed')
+
+    def test_replay_retry(self):
+        self.store.threshold = 3
+        self.inner.down = True
+
+        for i in range(2):
+            self.run_until_complete(self.store.set('%02x' % i, b'{}'))
+
+        self.assertEqual(self.store.state, 'closed')
+        self.assertEqual(len(self.store.buffer), 2)
+
+        # a later successful operation replays the buffer
+        self.inner.down = False
+        self.run_until_complete(self.store.get('5e55'))
+        self.run_until_complete(asyncio.sleep(0.05))
+
+        self.assertEqual(len(self.store.buffer), 0)
+        self.assertEqual(self.inner.keys(), ['00', '01'])
+
+    def test_replay_background(self):
+        self.store.threshold = 100
+        self.inner.down = True
+
+        for i in range(20):
+            self.run_until_complete(self.store.set('%02x' % i, b'{}'))
+
+        self.inner.down = False
+        self.inner.delay = 0.01
+        start = time.monotonic()
+        self.run_until_complete(self.store.get('5e55'))
+
+        # doesn't wait for the 20 buffered writes
+        self.assertLess(time.monotonic() - start, 0.1)
+        self.assertTrue(self.store._replaying)
+
+        self.run_until_complete(self.store._replay_task)
+        self.assertEqual(len(self.store.buffer), 0)
+        self.assertEqual(len(self.inner.keys()), 20)
+
+    def test_buffer_size(self):
+        self.store.buffer_size = 2
+        self.inner.down = True
+
+        for i in range(4):
+            self.run_until_complete(self.store.set('%02x' % i, b'{}'))
+
+        self.assertEqual(list(self.store.buffer), ['02', '03'])
+        self.assertEqual(self.store.dropped, 2)
+
+
+class TestCapacity(unittest.TestCase):
+    def setUp(self):
+        print('\r\n[', self.id(), ']')
+
+        self.loop = asyncio.new_event_loop()
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.loop.close()
+        self.tmp.cleanup()
+
+    def test_memory_lru(self):
+        store = MemoryStore(max_sessions=2)
+        store.set('0a', b'{}')
+        store.set('0b', b'{}')
+        store.get('0a')
+        store.set('0c', b'{}')
+
+        self.assertEqual(store.keys(), ['0a', '0c'])
+
+        store = MemoryStore(max_bytes=10)
+        store.set('0a', b'{"a": 1}')
+        store.set('0b', b'{"b": 2}')
+
+        self.assertEqual(store.keys(), ['0b'])
+        self.assertEqual(store.bytes, 8)
+
+    def test_file_lru(self):
+        store = FileStore(self.tmp.name, max_sessions=10)
+
+        for i in range(12):
+            store.set('%02d' % i, b'{}')
+            os.utime(store.filepath('%02d' % i), (i, i))
+
+        store.get('00')
+        self.loop.run_until_complete(store.evict())
+
+        self.assertEqual(sorted(store.keys()),
+                         ['00'] + ['%02d' % i for i in range(4, 12)])
+
+        store = FileStore(self.tmp.name, max_bytes=16)
+        self.loop.run_until_complete(store.evict())
+
+        self.assertEqual(sorted(store.keys()),
+                         ['00'] + ['%02d' % i for i in range(6, 12)])
+
+        store = FileStore(self.tmp.name, max_sessions=1)
+        self.loop.run_until_complete(store.evict())
+
+        self.assertEqual(list(store.keys()), ['00'])
+
+    def test_file_evictor(self):
+        a = FileStore(self.tmp.name, max_sessions=10, evict_interval=0.01)
+        b = FileStore(self.tmp.name, max_sessions=10, evict_interval=0.01)
+
+        # one worker evicts at a time
+        self.assertTrue(a._is_evictor())
+        self.assertEqual(b._is_evictor(), fcntl is None)
+
+        a.stop()
+        self.assertTrue(b._is_evictor())
+        b.stop()
+
+        async def fail():
+            raise OSError('Input/output error')
+
+        b.evict = fail
+        b.start(self.loop)
+
+        try:
+            with self.assertLogs('tremolo_session.stores', 'ERROR'):
+                self.loop.run_until_complete(asyncio.sleep(0.05))
+
+            # still running
+            self.assertFalse(b._tasks[0].done())
+        finally:
+            b.stop()
+            self.loop.run_until_complete(asyncio.sleep(0))
+
+
+class TestMemoryStore(unittest.TestCase):
+    def setUp(self):
+        print('\r\n[', self.id(), ']')
+
+        self.loop = asyncio.new_event_loop()
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.loop.close()
+        self.tmp.cleanup()
+
+    def test_cleanup(self):
+        store = MemoryStore()
+        now = time.time()
+        store.set('00', b'{}', now - 1)
+        store.set('01', b'{}', now - 1)
+        store.set('02', b'{}', now + 1)
+        store.set('03', b'{}')
+        store.set('01', b'{}', now + 60)  # renewed
+        self.assertTrue(store.touch('02', now + 60))
+
+        self.assertEqual(store.cleanup(), 1)
+        self.assertEqual(store.keys(), ['03', '01', '02'])
+        self.assertEqual(store.expiry('02'), now + 60)
+        self.assertFalse(store.touch('00'))
+
+    def test_version(self):
+        store = MemoryStore()
+        store.set('5e55', b'{}')
+        version = store.version('5e55')
+
+        store.touch('5e55', time.time() + 60)
+        self.assertEqual(store.version('5e55'), version)
+
+        store.set('5e55', b'{}')
+        self.assertNotEqual(store.version('5e55'), version)
+        self.assertIsNone(store.version('ba55'))
+
+        store = FileStore(self.tmp.name)
+        store.set('5e55', b'{}')
+
+        # just written
+        self.assertIsNone(store.version('5e55'))
+
+        os.utime(store.filepath('5e55'), (1, 1))
+        version = store.version('5e55')
+        self.assertEqual(version[1:], (1000000000, 2))
+
+        store.set('5e55', b'{}')
+        os.utime(store.filepath('5e55'), (2, 2))
+        self.assertNotEqual(store.version('5e55'), version)
+
+    def test_snapshot(self):
+        path = os.path.join(self.tmp.name, 'sess.snapshot')
+        store = MemoryStore(snapshot=path)
+        store.set('5e55', b'{"foo": "bar"}', time.time() + 60)
+        store.set('ba55', b'{}', time.time() - 1)
+        store.set('c0de', b'{}')
+        store.stop()
+
+        store = MemoryStore(snapshot=path)
+        store.start(self.loop)
+
+        try:
+            self.assertEqual(store.keys(), ['5e55', 'c0de'])
+            self.assertEqual(store.get('5e55'), b'{"foo": "bar"}')
+            self.assertEqual(os.listdir(self.tmp.name), ['sess.snapshot'])
+        finally:
+            store.stop()
+
+            # let the cancelled tasks finish
+            self.loop.run_until_complete(asyncio.sleep(0))
+
+
+class TestVolumes(unittest.TestCase):
+    def setUp(self):
+        print('\r\n[', self.id(), ']')
+
+        self.loop = asyncio.new_event_loop()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.volumes = []
+
+        for name in ('a', 'b', 'c'):
+            self.volumes.append(os.path.join(self.tmp.name, name))
+            os.mkdir(self.volumes[-1])
+
+    def tearDown(self):
+        self.loop.close()
+        self.tmp.cleanup()
+
+    def test_spread(self):
+        store = FileStore({self.volumes[0]: 1, self.volumes[1]: 3})
+
+        for i in range(400):
+            store.set('%064x' % i, b'{}')
+
+        self.assertEqual(len(list(store.keys())), 400)
+        self.assertTrue(
+            60 < len(os.listdir(self.volumes[0])) < 140
+        )
+
+    def test_add_volume(self):
+        old = FileStore(self.volumes[:2])
+        ids = ['%064x' % i for i in range(300)]
+
+        for session_id in ids:
+            old.set(session_id, b'{}')
+
+        store = FileStore(self.volumes, previous=self.volumes[:2])
+        moved = [session_id for session_id in ids
+                 if old.filepath(session_id) != store.filepath(session_id)]
+
+        # only the sessions that land on the new volume are moved
+        self.assertTrue(all(
+            os.path.dirname(store.filepath(session_id)) == self.volumes[2]
+            for session_id in moved
+        ))
+        self.assertTrue(50 < len(moved) < 150)
+
+        # falls back to the former placement
+        self.assertEqual(store.get(moved[0]), b'{}')
+        self.assertTrue(os.path.exists(store.filepath(moved[0])))
+        self.assertTrue(store.exists(moved[1]))
+
+        self.loop.run_until_complete(store.rebalance())
+
+        self.assertIsNone(store.previous)
+        self.assertEqual(len(os.listdir(self.volumes[2])), len(moved))
+        self.assertTrue(all(store.exists(session_id) for session_id in ids))
+
+
+class TestBloomFilterStore(unittest.TestCase):
+    def setUp(self):
+        print('\r\n[', self.id(), ']')
+
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(1000, 0.01)
+        keys = ['%064x' % i for i in range(1000)]
+
+        for key in keys:
+            bloom.add(key)
+
+        self.assertTrue(all(key in bloom for key in keys))
+        self.assertLess(
+            sum('%064x' % i in bloom for i in range(1000, 11000)), 300
+        )
+
+    def test_definite_miss(self):
+        inner = CountingStore()
+        inner.set('5e55', b'{}')
+        store = BloomFilterStore(inner, capacity=100)
+
+        self.assertIsNone(store.get('ba55'))
+        self.assertEqual(inner.calls, 1)  # not built yet, pass through
+
+        self.loop.run_until_complete(store.start(self.loop))
+
+        self.assertIsNone(store.get('ba55'))
+        self.assertFalse(store.exists('ba55'))
+        self.assertIsNone(store.version('ba55'))
+        self.assertEqual(store.get('5e55'), b'{}')
+        self.assertEqual(inner.calls, 2)
+
+        store.set('ba55', b'{}')
+        self.assertEqual(store.get('ba55'), b'{}')
+
+        store.delete('ba55')
+        self.assertIsNone(store.get('ba55'))
+        self.assertEqual(store.deleted, 1)
+
+        self.loop.run_until_complete(store.rebuild())
+        self.assertEqual(store.deleted, 0)
+        self.assertFalse(store.exists('ba55'))
+
+        self.loop.run_until_complete(store.stop())
+
+    def test_repeat_saves(self):
+        inner = MemoryStore()
+        store = BloomFilterStore(inner, capacity=100)
+        self.loop.run_until_complete(store.start(self.loop))
+
+        for _ in range(1000):
+            for i in range(10):
+                store.set('%02x' % i, b'{}')
+
+        self.assertEqual(len(store.bloom), 10)
+        self.assertEqual(store.bloom.capacity, 100)
+
+        for i in range(10, 200):
+            inner.set('%02x' % i, b'{}')
+
+        self.loop.run_until_complete(store.rebuild())
+        self.assertEqual(store.bloom.capacity, 400)
+
+        self.loop.run_until_complete(store.stop())
+
+    def test_add_while_listing(self):
+        class SlowStore(MemoryStore):
+            async def keys(self):
+                keys = super().keys()
+                await asyncio.sleep(0.01)
+                return keys
+
+        inner = SlowStore()
+        store = BloomFilterStore(inner, capacity=100)
+        self.loop.run_until_complete(store.start(self.loop))
+
+        async def rebuild():
+            task = self.loop.create_task(store.rebuild())
+            await asyncio.sleep(0)
+            store.set('5e55', b'{}')  # while listing the keys
+            await task
+
+        self.loop.run_until_complete(rebuild())
+        self.assertTrue(store.exists('5e55'))
+
+        self.loop.run_until_complete(store.stop())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,21 +1,80 @@
 # SPDX-License-Identifier: MIT
 # Copyright (c) 2023 Anggit Arfanto
 
+import asyncio
+import base64
+import binascii
 import hashlib
 import json
 import os
 import tempfile
 import time
 
+from datetime import datetime, timedelta, timezone
+from inspect import isawaitable
+from urllib.parse import quote
+
 from tremolo.exceptions import Forbidden
 
+from .stores import (
+    Store,
+    BloomFilterStore,
+    BreakerStore,
+    FileStore,
+    MemoryStore,
+    MigrationStore,
+    TieredStore
+)
+from .daemon import DaemonStore
+from .replication import ReplicatedStore
+from .utils import maybe_await
+
 __version__ = '1.0.13'
-__all__ = ['Session', 'SessionData']
+__all__ = ['Session', 'SessionData',
+           'Store', 'BloomFilterStore', 'BreakerStore', 'DaemonStore',
+           'FileStore', 'MemoryStore', 'MigrationStore', 'ReplicatedStore',
+           'TieredStore']
+
+READ_WRITE = 'read-write'
+READ_ONLY = 'read-only'
+NO_RENEW = 'no-renew'
+SKIP = 'skip'
+
+HEX = 'hex'
+COMPACT = 'compact'
+
+# base64url of a version byte, a 128-bit id, and a 32-bit expiration time
+COMPACT_VERSION = 1
+COMPACT_SIZE = 28
+
+CACHE_CONTROL = b'no-cache, must-revalidate'
+EXPIRES = b'Thu, 01 Jan 1970 00:00:00 GMT'
+
+
+def parse_cookie(value):
+    # returns ``(session_id, expires)``, or raises ValueError
+    if len(value) == COMPACT_SIZE:
+        try:
+            data = base64.urlsafe_b64decode(value)
+        except binascii.Error as exc:
+            raise ValueError(str(exc)) from exc
+
+        if len(data) != 21 or data[0] != COMPACT_VERSION:
+            raise ValueError('unknown cookie format')
+
+        return data[1:17].hex(), int.from_bytes(data[17:], 'big')
+
+    # legacy, hex id and decimal timestamp
+    session_id, expires = value.split('.', 1)
+    bytes.fromhex(session_id)
+
+    return session_id, int(expires)
 
 
 class Session:
     def __init__(self, app, name='sess', path='sess', paths=(),
-                 expires=1800, cookie_params={}):
+                 expires=1800, cookie_params={}, store=None,
+                 migrate_from=None, cookie_format=HEX):
         """A simple, file-based session middleware for Tremolo.
 
         :param app: The Tremolo app object
@@ -24,21 +83,98 @@ class Session:
         :param path: A session directory path where the session files will be
             stored. E.g. ``/path/to/dir``. If it doesn't exist, it will be
             created under the Operating System temporary directory.
+            A list of paths, or a dict of ``{path: weight}``, spreads
+            the session files across several volumes, which must exist.
         :param paths: A list of url path prefixes
             where the ``Set-Cookie`` header should appear.
             ``['/']`` will match ``/any``,
             ``['/users']`` will match ``/users/login``, etc.
+            It can also be a dict of ``{prefix: policy}``, the longest
+            matching prefix wins:
+
+            - ``'read-write'``, the default
+            - ``'read-only'``, the session is loaded but never saved,
+              and there is no ``Set-Cookie``
+            - ``'no-renew'``, the session is saved if modified,
+              but the expiration time is not extended
+            - ``'skip'``, the session is never loaded
+        :param store: A store object, e.g. ``TieredStore(MemoryStore(),
+            FileStore('/path/to/dir'))``. If omitted, a ``FileStore``
+            will be created using ``path``.
+        :param migrate_from: The former store while migrating to ``store``.
+            Sessions are read from both and written to both, so the stores
+            can be switched without logging everyone out.
+        :param cookie_format: The format of new session cookies.
+            ``'hex'``, a 256-bit hex id and a decimal timestamp, or
+            ``'compact'``, a 128-bit id with a packed timestamp in base64url,
+            less than half the size. Both formats are always accepted,
+            existing sessions keep theirs until they are renewed
+            with a new id.
         """
+        if cookie_format not in (HEX, COMPACT):
+            raise ValueError('unknown cookie format: %s' % cookie_format)
+
         self.name = name
-        self.path = self._get_path(path, app.__class__.__name__)
-        self.paths = {v.rstrip('/').encode('latin-1') for v in paths}
+        self.cookie_format = cookie_format
+
+        if store is None:
+            prefix = app.__class__.__name__
+
+            if isinstance(path, str):
+                self.path = self._get_path(path, prefix)
+                self.store = FileStore(self.path)
+            else:
+                if not isinstance(path, dict):
+                    path = dict.fromkeys(path, 1)
+
+                if len(path) > 1:
+                    # the temporary fallback would merge them into one
+                    for k in path:
+                        if not os.path.isdir(k):
+                            raise FileNotFoundError(
+                                'session volume not found: %s' % k
+                            )
+                else:
+                    path = {self._get_path(k, prefix): v
+                            for k, v in path.items()}
+
+                self.store = FileStore(path)
+                self.path = self.store.path
+        else:
+            self.path = getattr(store, 'path', None)
+            self.store = store
+
+        if migrate_from is not None:
+            self.store = MigrationStore(migrate_from, self.store)
+
+        if not isinstance(paths, dict):
+            paths = dict.fromkeys(paths, READ_WRITE)
+
+        for policy in paths.values():
+            if policy not in (READ_WRITE, READ_ONLY, NO_RENEW, SKIP):
+                raise ValueError('unknown session policy: %s' % policy)
+
+        self.paths = {
+            k.rstrip('/').encode('latin-1'): v for k, v in paths.items()
+        }
         self.expires = min(expires, 31968000)
 
         # overwrite to maximum cookie validity (400 days)
-        cookie_params['expires'] = 34560000
+        self.cookie_params = dict(cookie_params, expires=34560000)
+
+        # the parts of Set-Cookie that don't change between requests
+        self._cookie_name = name.encode('latin-1') + b'='
+        self._cookie_attrs = self._render_cookie_attrs(**self.cookie_params)
+        self._cookie_suffix = (0, 0, b'')
+
+        # in-flight loads by session id, shared by concurrent requests
+        self._loading = {}
 
-        self.cookie_params = cookie_params
+        # the last session loaded on a connection, and its store version
+        self._context_key = 'session_%s' % name
 
+        app.add_hook(self._on_worker_start, 'worker_start')
+        app.add_hook(self._on_worker_stop, 'worker_stop')
         app.add_middleware(self._on_request, 'request')
         app.add_middleware(self._on_response, 'response')
 
@@ -58,106 +194,257 @@ class Session:
 
         return tmp
 
-    def _regenerate_id(self, request, response):
+    async def _on_worker_start(self, loop, logger=None, **_):
+        if logger is not None:
+            Store.logger = logger
+
+        await maybe_await(self.store.start(loop))
+
+    async def _on_worker_stop(self, **_):
+        await maybe_await(self.store.stop())
+
+    async def _load(self, session_id):
+        fut = self._loading.get(session_id)
+
+        if fut is not None:
+            await asyncio.wait((fut,))
+
+            if not fut.cancelled():
+                return fut.result()
+
+            # the first request has failed, load it on our own
+            return await maybe_await(self.store.get(session_id))
+
+        value = self.store.get(session_id)
+
+        if not isawaitable(value):
+            return value
+
+        fut = self._loading[session_id] = (
+            asyncio.get_event_loop().create_future()
+        )
+
+        try:
+            value = await value
+        except BaseException:
+            fut.cancel()
+            raise
+        else:
+            fut.set_result(value)
+        finally:
+            del self._loading[session_id]
+
+        return value
+
+    async def _load_cached(self, context, session_id):
+        # keep-alive and pipelined requests on a connection usually
+        # carry the same cookie. reuse the value while it's still current
+        version = getattr(self.store, 'version', None)
+        version = version and await maybe_await(version(session_id))
+
+        if version is None:
+            context.pop(self._context_key, None)
+            return await self._load(session_id)
+
+        cached = context.get(self._context_key)
+
+        if cached is not None and cached[:2] == (session_id, version):
+            return cached[2]
+
+        value = await self._load(session_id)
+
+        if value is None:
+            context.pop(self._context_key, None)
+        else:
+            context[self._context_key] = (session_id, version, value)
+
+        return value
+
+    async def _regenerate_id(self, request, response):
         for i in range(2):
-            session_id = hashlib.sha256(request.uid(32 + i)).hexdigest()
+            session_id = hashlib.sha256(request.uid(32 + i)).digest()
 
-            if not os.path.exists(os.path.join(self.path, session_id)):
+            if self.cookie_format == COMPACT:
+                session_id = session_id[:16]
+
+            session_id = session_id.hex()
+
+            if not await maybe_await(self.store.exists(session_id)):
                 return session_id
 
         raise FileExistsError('session id collision')
 
-    def _set_cookie(self, response, session_id):
-        response.set_cookie(
-            self.name,
-            '%s.%d' % (session_id, int(time.time() + self.expires)),
-            **self.cookie_params
+    def _render_cookie_attrs(self, expires=0, path='/', domain=None,
+                             secure=False, httponly=False, samesite=None):
+        # same format as tremolo's response.set_cookie(),
+        # without the ``expires=`` date which is rendered once per second
+        attrs = bytearray(
+            b'; max-age=%d; path=%s' % (expires, quote(path).encode('latin-1'))
         )
 
+        for k, v in ((b'domain', domain), (b'samesite', samesite)):
+            if v:
+                attrs.extend(b'; %s=%s' % (k, quote(v).encode('latin-1')))
+
+        for k, v in ((secure, b'; secure'), (httponly, b'; httponly')):
+            if k:
+                attrs.extend(v)
+
+        return bytes(attrs)
+
+    def _set_cookie(self, response, session_id):
+        now = int(time.time())
+        ts, stamp, suffix = self._cookie_suffix
+
+        if ts != now:
+            date_expired = (
+                datetime.fromtimestamp(now, timezone.utc) +
+                timedelta(seconds=self.cookie_params['expires'])
+            ).strftime('%a, %d %b %Y %H:%M:%S GMT').encode('latin-1')
+            stamp = now + self.expires
+            suffix = b'; expires=%s%s' % (date_expired, self._cookie_attrs)
+            self._cookie_suffix = (now, stamp, suffix)
+
+        if len(session_id) == 32:  # created with cookie_format='compact'
+            value = base64.urlsafe_b64encode(
+                bytes((COMPACT_VERSION,)) + bytes.fromhex(session_id) +
+                stamp.to_bytes(4, 'big')
+            )
+        else:
+            value = b'%s.%d' % (session_id.encode('latin-1'), stamp)
+
+        response.append_header(b'Set-Cookie',
+                               self._cookie_name + value + suffix)
+        return stamp
+
     async def _on_request(self, request, response, **_):
         request.ctx.session = None
-        path = request.path.rstrip(b'/')
-        depth = 0
+        policy = READ_WRITE
+
+        if self.paths:
+            path = request.path.rstrip(b'/')
+            depth = 0
 
-        while depth < 255:
-            if not self.paths or path in self.paths:
-                break
+            while depth < 255:
+                if path in self.paths:
+                    policy = self.paths[path]
+                    break
 
-            end = path.rfind(b'/')
+                end = path.rfind(b'/')
 
-            if end == -1:
+                if end == -1:
+                    return
+
+                path = path[:end]
+                depth += 1
+            else:
                 return
 
-            path = path[:end]
-            depth += 1
-        else:
+        if policy == SKIP:
             return
 
-        response.set_header(b'Cache-Control', b'no-cache, must-revalidate')
-        response.set_header(b'Expires', b'Thu, 01 Jan 1970 00:00:00 GMT')
+        response.set_header(b'Cache-Control', CACHE_CONTROL)
+        response.set_header(b'Expires', EXPIRES)
 
         if self.name not in request.cookies:
-            self._set_cookie(response, self._regenerate_id(request, response))
+            if policy != READ_ONLY:
+                self._set_cookie(response,
+                                 await self._regenerate_id(request, response))
             return
 
         try:
-            session_id, expires = request.cookies[self.name][0].split('.', 1)
-            bytes.fromhex(session_id)
-
-            expires = int(expires)
+            session_id, expires = parse_cookie(request.cookies[self.name][0])
         except (KeyError, ValueError) as exc:
-            self._set_cookie(response, self._regenerate_id(request, response))
+            if policy != READ_ONLY:
+                self._set_cookie(response,
+                                 await self._regenerate_id(request, response))
             raise Forbidden('bad cookie') from exc
 
-        session_filepath = os.path.join(self.path, session_id)
         session = {}
+        value = None
 
-        if os.path.isfile(session_filepath):
-            if time.time() > expires:
-                os.unlink(session_filepath)
-            else:
-                fp = open(session_filepath, 'r')
+        if time.time() > expires:
+            if policy != READ_ONLY:
+                await maybe_await(self.store.delete(session_id))
+        else:
+            # each request parses its own copy of the shared value
+            value = await self._load_cached(request.server.context,
+                                            session_id)
 
+            if value is not None:
                 try:
-                    session.update(json.loads(fp.read()))
-                    fp.close()
+                    session.update(json.loads(value))
                 except ValueError:
-                    fp.close()
-                    os.unlink(session_filepath)
+                    await maybe_await(self.store.delete(session_id))
+                    value = None
 
-        if not os.path.isfile(session_filepath):
-            session_id = self._regenerate_id(request, response)
-            session_filepath = os.path.join(self.path, session_id)
+        if value is None:
+            if policy == READ_ONLY:
+                return
 
-        request.ctx.session = SessionData(self.name,
-                                          session_id,
-                                          session,
-                                          session_filepath,
-                                          request)
+            session_id = await self._regenerate_id(request, response)
+            policy = READ_WRITE  # a new session always gets its cookie
 
-        # always renew/update session and cookie expiration time
-        self._set_cookie(response, session_id)
+        if policy == READ_WRITE:
+            # renew/update session and cookie expiration time
+            expires = self._set_cookie(response, session_id)
+
+        request.ctx.session = SessionData(
+            self.name,
+            session_id,
+            session,
+            self.store,
+            request,
+            expires=expires,
+            readonly=policy == READ_ONLY,
+            renew=value is not None and policy == READ_WRITE
+        )
 
     async def _on_response(self, request, **_):
         if request.ctx.session is not None:
-            request.ctx.session.save()
+            await maybe_await(request.ctx.session.save())
 
 
 class SessionData(dict):
-    def __init__(self, name, session_id, session, filepath, request):
+    def __init__(self, name, session_id, session, store, request,
+                 expires=None, readonly=False, renew=False):
         self.name = name
         self.id = session_id
         self.session = session
-        self.filepath = filepath
+        self.store = store
         self.request = request
+        self.expires = expires
+        self.readonly = readonly
+        self.renew = renew
 
         self.update(session)
 
+    @property
+    def filepath(self):
+        # None if the store doesn't keep sessions as files
+        filepath = getattr(self.store, 'filepath', None)
+        return filepath and filepath(self.id)
+
+    def _schedule(self, result):
+        # with an asynchronous store, the call takes effect
+        # even if the caller doesn't await the returned future
+        if isawaitable(result):
+            return asyncio.ensure_future(result)
+
+        return result
+
     def save(self):
+        if self.readonly:
+            return None
+
         if self != self.session:
-            with open(self.filepath, 'w') as fp:
-                json.dump(self, fp)
+            return self._schedule(self.store.set(
+                self.id, json.dumps(self).encode('utf-8'), self.expires
+            ))
+
+        if self.renew:
+            # the cookie has been renewed, extend the stored expiration too
+            return self._schedule(self.store.touch(self.id, self.expires))
 
     def delete(self):
-        if os.path.exists(self.filepath):
-            os.unlink(self.filepath)
+        return self._schedule(self.store.delete(self.id))
@@ -0,0 +1,108 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2023 Anggit Arfanto
+
+import argparse
+import asyncio
+import sys
+
+from . import daemon, migrate
+from .stores import FileStore, MemoryStore
+
+
+def file_store(paths):
+    # '/path/to/dir' or '/path/to/dir=WEIGHT'
+    volumes = {}
+
+    for path in paths:
+        name, sep, weight = path.rpartition('=')
+
+        if sep and weight.isdigit():
+            volumes[name] = int(weight)
+        else:
+            volumes[path] = 1
+
+    return FileStore(volumes)
+
+
+def add_batch_options(cmd, write=True):
+    cmd.add_argument('--batch-size', type=int, default=100)
+
+    if write:
+        cmd.add_argument(
+            '--ttl', type=int, default=None,
+            help='expiration, in seconds from now, for sessions without one'
+        )
+        cmd.add_argument('--overwrite', action='store_true',
+                         help='overwrite the existing sessions')
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog='python3 -m tremolo_session',
+        description='Export, import, or copy sessions between stores, '
+                    'or serve sessions to the workers of a host.'
+    )
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    cmd = commands.add_parser('export', help='write sessions as JSON lines')
+    cmd.add_argument('path', nargs='+', help='session directories')
+    cmd.add_argument('-o', '--output', type=argparse.FileType('w'),
+                     default=sys.stdout)
+    add_batch_options(cmd, write=False)
+
+    cmd = commands.add_parser('import', help='read sessions as JSON lines')
+    cmd.add_argument('path', nargs='+', help='session directories')
+    cmd.add_argument('-i', '--input', type=argparse.FileType('r'),
+                     default=sys.stdin)
+    add_batch_options(cmd)
+
+    cmd = commands.add_parser('copy', help='copy sessions between stores')
+    cmd.add_argument('--from', dest='src', nargs='+', required=True,
+                     help='source session directories')
+    cmd.add_argument('--to', dest='dst', nargs='+', required=True,
+                     help='destination session directories, '
+                          'with optional =WEIGHT suffixes')
+    cmd.add_argument('--delete', action='store_true',
+                     help='delete the sessions from the source (move)')
+    add_batch_options(cmd)
+
+    cmd = commands.add_parser(
+        'serve', help='keep sessions in memory, shared by all workers'
+    )
+    cmd.add_argument('path', help='Unix socket path')
+    cmd.add_argument('--snapshot', help='file to save the sessions to')
+    cmd.add_argument('--snapshot-interval', type=int, default=60,
+                     help='in seconds, 0 saves only on exit')
+    cmd.add_argument('--max-sessions', type=int, default=0)
+    cmd.add_argument('--max-bytes', type=int, default=0)
+
+    args = parser.parse_args(args)
+    loop = asyncio.new_event_loop()
+
+    try:
+        if args.command == 'export':
+            coro = migrate.export(file_store(args.path), args.output,
+                                  args.batch_size)
+        elif args.command == 'import':
+            coro = migrate.import_(file_store(args.path), args.input,
+                                   args.batch_size, args.ttl, args.overwrite)
+        elif args.command == 'serve':
+            coro = daemon.serve(args.path, MemoryStore(
+                args.max_sessions, args.max_bytes, args.snapshot,
+                args.snapshot_interval
+            ))
+        else:
+            coro = migrate.copy(file_store(args.src), file_store(args.dst),
+                                args.batch_size, args.ttl, args.overwrite,
+                                args.delete)
+
+        count = loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+    print('%s: %d sessions' % (args.command, count), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2023 Anggit Arfanto
+
+import hashlib
+import math
+
+
+class BloomFilter:
+    def __init__(self, capacity=100000, error_rate=0.01):
+        """A Bloom filter sized for ``capacity`` items.
+
+        Membership tests may return false positives,
+        at roughly ``error_rate``, but never false negatives.
+        """
+        self.capacity = max(capacity, 1)
+        self.error_rate = error_rate
+        self.size = int(
+            -self.capacity * math.log(error_rate) / (math.log(2) ** 2)
+        ) or 8
+        self.hashes = max(round(self.size / self.capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('latin-1'),
+                                 digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:], 'big') | 1
+
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key):
+        added = False
+
+        for pos in self._positions(key):
+            bit = 1 << (pos & 7)
+
+            if not self.bits[pos >> 3] & bit:
+                self.bits[pos >> 3] |= bit
+                added = True
+
+        # keys that were already present aren't counted again
+        if added:
+            self.count += 1
+
+    def __contains__(self, key):
+        for pos in self._positions(key):
+            if not self.bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+
+        return True
+
+    def __len__(self):
+        return self.count
@@ -0,0 +1,378 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2023 Anggit Arfanto
+
+import asyncio
+import os
+import signal
+import stat
+import struct
+
+from collections import deque
+
+from .stores import MemoryStore, Store
+from .utils import maybe_await
+
+OP_GET = b'G'
+OP_SET = b'S'
+OP_TOUCH = b'T'
+OP_DELETE = b'D'
+OP_EXISTS = b'E'
+OP_EXPIRY = b'X'
+OP_KEYS = b'K'
+
+OK = b'+'
+NOT_FOUND = b'-'
+ERROR = b'!'
+
+MAX_VALUE_SIZE = 16 * 1048576
+
+# op, id length, value length, expires. followed by the id and the value
+_REQUEST = struct.Struct('!cBId')
+# status, value length, expires. followed by the value
+_RESPONSE = struct.Struct('!cId')
+
+
+def check_platform():
+    if not hasattr(asyncio, 'start_unix_server'):
+        raise RuntimeError('the session daemon requires Unix sockets, '
+                           'which are not available on this platform')
+
+
+def pack_request(op, session_id=b'', value=b'', expires=None):
+    return (_REQUEST.pack(op, len(session_id), len(value), expires or 0) +
+            session_id + value)
+
+
+def pack_response(status, value=b'', expires=None):
+    return _RESPONSE.pack(status, len(value), expires or 0) + value
+
+
+def pack_keys(keys):
+    return b''.join(bytes((len(key),)) + key for key in keys)
+
+
+def unpack_keys(data):
+    keys = []
+    offset = 0
+
+    while offset < len(data):
+        end = offset + 1 + data[offset]
+        keys.append(data[offset + 1:end].hex())
+        offset = end
+
+    return keys
+
+
+class SessionServer:
+    def __init__(self, path, store=None):
+        """Own the sessions of all workers on a host, and serve them
+        over a Unix socket.
+
+        :param path: The Unix socket path. It is created with mode 0600
+        :param store: Where the sessions are kept.
+            Defaults to a ``MemoryStore()``. Use
+            ``MemoryStore(snapshot='/path/to/file')`` to keep the sessions
+            across restarts
+        """
+        check_platform()
+
+        self.path = path
+        self.store = store or MemoryStore()
+        self._connections = set()
+        self._server = None
+
+    async def start(self):
+        await maybe_await(self.store.start(asyncio.get_event_loop()))
+
+        try:
+            if stat.S_ISSOCK(os.stat(self.path).st_mode):
+                os.unlink(self.path)  # stale
+        except FileNotFoundError:
+            pass
+
+        self._server = await asyncio.start_unix_server(self._accept,
+                                                       self.path)
+        os.chmod(self.path, 0o600)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            tasks = list(self._connections)
+
+            for task in tasks:
+                task.cancel()
+
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+        await maybe_await(self.store.stop())
+
+    def _accept(self, reader, writer):
+        task = asyncio.ensure_future(self._handle(reader, writer))
+        self._connections.add(task)
+        task.add_done_callback(self._connections.discard)
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                op, id_length, length, expires = _REQUEST.unpack(
+                    await reader.readexactly(_REQUEST.size)
+                )
+
+                if length > MAX_VALUE_SIZE:
+                    break
+
+                session_id = (await reader.readexactly(id_length)).hex()
+                value = await reader.readexactly(length)
+
+                writer.write(
+                    await self._execute(op, session_id, value, expires or None)
+                )
+                await writer.drain()
+        except (OSError, EOFError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _execute(self, op, session_id, value, expires):
+        store = self.store
+
+        try:
+            if op == OP_GET:
+                value = await maybe_await(store.get(session_id))
+
+                if value is None:
+                    return pack_response(NOT_FOUND)
+
+                return pack_response(
+                    OK, value, await maybe_await(store.expiry(session_id))
+                )
+
+            if op == OP_SET:
+                await maybe_await(store.set(session_id, value, expires))
+                return pack_response(OK)
+
+            if op == OP_TOUCH and hasattr(store, 'touch'):
+                if await maybe_await(store.touch(session_id, expires)):
+                    return pack_response(OK)
+
+                return pack_response(NOT_FOUND)
+
+            if op == OP_TOUCH:
+                value = await maybe_await(store.get(session_id))
+
+                if value is None:
+                    return pack_response(NOT_FOUND)
+
+                await maybe_await(store.set(session_id, value, expires))
+                return pack_response(OK)
+
+            if op == OP_DELETE:
+                await maybe_await(store.delete(session_id))
+                return pack_response(OK)
+
+            if op == OP_EXISTS:
+                if await maybe_await(store.exists(session_id)):
+                    return pack_response(OK)
+
+                return pack_response(NOT_FOUND)
+
+            if op == OP_EXPIRY:
+                return pack_response(
+                    OK, b'', await maybe_await(store.expiry(session_id))
+                )
+
+            if op == OP_KEYS:
+                return pack_response(OK, pack_keys(
+                    bytes.fromhex(key)
+                    for key in await maybe_await(store.keys())
+                ))
+        except Exception as exc:
+            return pack_response(ERROR, str(exc).encode('utf-8'))
+
+        return pack_response(ERROR, b'unknown operation')
+
+
+class Connection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.pending = deque()
+        self.closed = False
+        self._lock = asyncio.Lock()
+        self._task = asyncio.ensure_future(self._read_forever())
+
+    async def request(self, op, session_id=b'', value=b'', expires=None):
+        if self.closed:
+            raise ConnectionError('connection closed')
+
+        fut = asyncio.get_event_loop().create_future()
+        self.pending.append(fut)
+        self.writer.write(pack_request(op, session_id, value, expires))
+
+        async with self._lock:
+            await self.writer.drain()
+
+        return await fut
+
+    async def _read_forever(self):
+        try:
+            while True:
+                status, length, expires = _RESPONSE.unpack(
+                    await self.reader.readexactly(_RESPONSE.size)
+                )
+                value = await self.reader.readexactly(length)
+                fut = self.pending.popleft()
+
+                if not fut.done():
+                    fut.set_result((status, value, expires or None))
+        except (OSError, EOFError, IndexError,
+                asyncio.IncompleteReadError) as exc:
+            self.close(exc)
+        except asyncio.CancelledError:
+            self.close()
+            raise
+
+    def close(self, exc=None):
+        if self.closed:
+            return
+
+        self.closed = True
+        self.writer.close()
+        self._task.cancel()
+
+        while self.pending:
+            fut = self.pending.popleft()
+
+            if not fut.done():
+                fut.set_exception(
+                    ConnectionError('connection to the daemon lost: %r' % exc)
+                )
+
+
+class DaemonStore(Store):
+    def __init__(self, path, pool_size=4):
+        """Use the sessions of a ``SessionServer``.
+
+        Requests are pipelined over a pool of connections, which are
+        opened on the first use and reopened as needed.
+
+        :param path: The Unix socket path of the server
+        :param pool_size: The number of connections per worker
+        """
+        check_platform()
+
+        self.path = path
+        self.pool_size = pool_size
+        self.connections = []
+        self._next = 0
+        self._lock = None
+
+    async def stop(self):
+        while self.connections:
+            self.connections.pop().close()
+
+    async def _connection(self):
+        connections = [conn for conn in self.connections if not conn.closed]
+        self.connections[:] = connections
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        if (not connections or
+                len(connections) < self.pool_size and
+                not self._lock.locked()):
+            async with self._lock:
+                while len(self.connections) < self.pool_size:
+                    try:
+                        reader, writer = await asyncio.open_unix_connection(
+                            self.path
+                        )
+                    except OSError:
+                        if not self.connections:
+                            raise
+
+                        break
+
+                    self.connections.append(Connection(reader, writer))
+
+        self._next = (self._next + 1) % len(self.connections)
+        return self.connections[self._next]
+
+    async def _request(self, op, session_id=None, value=b'', expires=None):
+        conn = await self._connection()
+        status, value, expires = await conn.request(
+            op, session_id and bytes.fromhex(session_id) or b'', value,
+            expires
+        )
+
+        if status == ERROR:
+            raise RuntimeError('daemon error: %s' % value.decode('utf-8'))
+
+        return status, value, expires
+
+    async def exists(self, session_id):
+        status, _, _ = await self._request(OP_EXISTS, session_id)
+        return status == OK
+
+    async def get(self, session_id):
+        status, value, _ = await self._request(OP_GET, session_id)
+
+        if status == OK:
+            return value
+
+        return None
+
+    async def set(self, session_id, value, expires=None):
+        await self._request(OP_SET, session_id, value, expires)
+
+    async def touch(self, session_id, expires=None):
+        """Update the expiration time without sending the value.
+
+        Returns False if the session does not exist.
+        """
+        status, _, _ = await self._request(OP_TOUCH, session_id, b'',
+                                           expires)
+        return status == OK
+
+    async def delete(self, session_id):
+        await self._request(OP_DELETE, session_id)
+
+    async def keys(self):
+        _, value, _ = await self._request(OP_KEYS)
+        return unpack_keys(value)
+
+    async def expiry(self, session_id):
+        _, _, expires = await self._request(OP_EXPIRY, session_id)
+        return expires
+
+
+async def serve(path, store=None):
+    """Run a ``SessionServer`` until SIGINT or SIGTERM.
+
+    Returns the number of sessions at exit.
+    """
+    loop = asyncio.get_event_loop()
+    server = SessionServer(path, store)
+    done = asyncio.Event()
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, done.set)
+
+    await server.start()
+
+    try:
+        await done.wait()
+    finally:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(sig)
+
+        await server.stop()
+
+    return len(await maybe_await(server.store.keys()))
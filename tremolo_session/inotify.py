@@ -0,0 +1,113 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2023 Anggit Arfanto
+
+import ctypes
+import ctypes.util
+import os
+import struct
+import sys
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+
+IN_ALL_CHANGES = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT = struct.Struct('iIII')  # wd, mask, cookie, len
+_libc = None
+
+
+def get_libc():
+    global _libc
+
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                            use_errno=True)
+
+    return _libc
+
+
+def available():
+    if not sys.platform.startswith('linux'):
+        return False
+
+    try:
+        return hasattr(get_libc(), 'inotify_init1')
+    except OSError:
+        return False
+
+
+class Watcher:
+    def __init__(self, callback, mask=IN_ALL_CHANGES):
+        """Watch directories with Linux inotify on the event loop.
+
+        :param callback: Called as ``callback(path, name, mask)`` for each
+            event. ``path`` and ``name`` are None if the event queue has
+            overflowed, and events were lost
+        """
+        self.callback = callback
+        self.mask = mask
+        self.fd = -1
+        self.paths = {}
+        self._loop = None
+
+    def start(self, loop, paths):
+        libc = get_libc()
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+
+        if self.fd == -1:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+        try:
+            for path in paths:
+                wd = libc.inotify_add_watch(self.fd, os.fsencode(path),
+                                            self.mask)
+
+                if wd == -1:
+                    errno = ctypes.get_errno()
+                    raise OSError(errno, os.strerror(errno), path)
+
+                self.paths[wd] = path
+        except BaseException:
+            self.stop()
+            raise
+
+        self._loop = loop
+        loop.add_reader(self.fd, self._read)
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.remove_reader(self.fd)
+            self._loop = None
+
+        if self.fd != -1:
+            os.close(self.fd)
+            self.fd = -1
+
+        self.paths.clear()
+
+    def _read(self):
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return
+
+        offset = 0
+
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+
+            if mask & IN_Q_OVERFLOW:
+                self.callback(None, None, mask)
+            elif wd in self.paths:
+                name = data[offset:offset + length].rstrip(b'\x00')
+                self.callback(self.paths[wd], os.fsdecode(name), mask)
+
+            offset += length
@@ -0,0 +1,117 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2023 Anggit Arfanto
+
+import asyncio
+import json
+import time
+
+from .utils import maybe_await
+
+
+async def batches(store, batch_size=100):
+    """Yield lists of ``(session_id, value, expires)``, read in batches
+    of ``batch_size`` sessions.
+    """
+    batch = []
+    expiry = getattr(store, 'expiry', None)
+
+    for session_id in await maybe_await(store.keys()):
+        value = await maybe_await(store.get(session_id))
+
+        if value is None:  # deleted in the meantime
+            continue
+
+        expires = expiry and await maybe_await(expiry(session_id))
+        batch.append((session_id, value, expires))
+
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+            await asyncio.sleep(0)
+
+    if batch:
+        yield batch
+
+
+async def import_batch(store, batch, ttl=None, overwrite=False):
+    count = 0
+    now = time.time()
+
+    for session_id, value, expires in batch:
+        if expires is None and ttl:
+            expires = now + ttl
+
+        if expires and now > expires:
+            continue
+
+        if not overwrite and await maybe_await(store.exists(session_id)):
+            # e.g. written by a MigrationStore since the copy started
+            continue
+
+        await maybe_await(store.set(session_id, value, expires))
+        count += 1
+
+    return count
+
+
+async def copy(src, dst, batch_size=100, ttl=None, overwrite=False,
+               delete=False):
+    """Copy sessions from one store to another, ``batch_size`` at a time.
+
+    :param ttl: Used as the expiration time, in seconds from now,
+        for sessions whose source store doesn't record it
+    :param overwrite: Overwrite the sessions already in ``dst``
+    :param delete: Delete the sessions from ``src`` after copying them
+    """
+    count = 0
+
+    async for batch in batches(src, batch_size):
+        count += await import_batch(dst, batch, ttl, overwrite)
+
+        if delete:
+            for session_id, *_ in batch:
+                await maybe_await(src.delete(session_id))
+
+    return count
+
+
+async def export(store, fp, batch_size=100):
+    """Write sessions to the text file ``fp``, one JSON object per line."""
+    count = 0
+
+    async for batch in batches(store, batch_size):
+        for session_id, value, expires in batch:
+            fp.write(json.dumps({'id': session_id,
+                                 'expires': expires,
+                                 'value': value.decode('utf-8')}) + '\n')
+
+        count += len(batch)
+
+    return count
+
+
+async def import_(store, fp, batch_size=100, ttl=None, overwrite=False):
+    """Read sessions written by ``export()`` from the text file ``fp``."""
+    count = 0
+    batch = []
+
+    for line in fp:
+        if not line.strip():
+            continue
+
+        item = json.loads(line)
+        session_id = item['id']
+        bytes.fromhex(session_id)  # not a path
+
+        batch.append((session_id, item['value'].encode('utf-8'),
+                      item['expires']))
+
+        if len(batch) >= batch_size:
+            count += await import_batch(store, batch, ttl, overwrite)
+            batch = []
+            await asyncio.sleep(0)
+
+    if batch:
+        count += await import_batch(store, batch, ttl, overwrite)
+
+    return count
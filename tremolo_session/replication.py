@@ -0,0 +1,360 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2023 Anggit Arfanto
+
+import asyncio
+import errno
+import os
+import struct
+import time
+
+from collections import OrderedDict, deque
+from inspect import isawaitable
+from itertools import islice
+
+from .stores import Store
+from .utils import maybe_await
+
+OP_SET = b'S'
+OP_DELETE = b'D'
+OP_TOUCH = b'T'
+OP_HELLO = b'H'
+
+MAX_FRAME_SIZE = 16 * 1048576
+
+_LENGTH = struct.Struct('!I')
+_SEQ = struct.Struct('!Q')
+_RECORD = struct.Struct('!cQddH')  # op, seq, ts, expires, id length
+
+
+def pack_frame(payload):
+    return _LENGTH.pack(len(payload)) + payload
+
+
+async def read_frame(reader):
+    length, = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))
+
+    if length > MAX_FRAME_SIZE:
+        raise ValueError('frame too large')
+
+    return await reader.readexactly(length)
+
+
+def pack_record(op, seq, ts, session_id, value=b'', expires=None):
+    session_id = session_id.encode('latin-1')
+
+    return pack_frame(
+        _RECORD.pack(op, seq, ts, expires or 0, len(session_id)) +
+        session_id + value
+    )
+
+
+def unpack_record(payload):
+    op, seq, ts, expires, length = _RECORD.unpack_from(payload)
+    end = _RECORD.size + length
+    session_id = payload[_RECORD.size:end].decode('latin-1')
+    bytes.fromhex(session_id)  # it will be used as a file name
+
+    return op, seq, ts, session_id, payload[end:], expires or None
+
+
+async def open_connection(address):
+    if isinstance(address, str):
+        return await asyncio.open_unix_connection(address)
+
+    return await asyncio.open_connection(*address)
+
+
+class ReplicatedStore(Store):
+    def __init__(self, store, listen=None, peers=(), batch_size=100,
+                 batch_delay=0.005, log_size=10000, reconnect_delay=5):
+        """Replicate the writes of a store to the peer nodes.
+
+        Each ``set()`` and ``delete()`` is published as a change record with
+        a sequence number, in batches, to every peer. The peers apply them
+        to their local store. After a reconnect, a peer catches up from the
+        last sequence it has applied, or with a full resync if the records
+        are no longer in the log. Conflicting writes are resolved
+        by the latest timestamp.
+
+        Only one worker per node listens, another one takes over if it
+        exits. The records are applied to the store of that worker, so
+        with several workers the local store must be shared by them,
+        e.g. a ``FileStore`` or a ``DaemonStore``, not a ``MemoryStore``.
+
+        :param store: The local store
+        :param listen: Where to accept the records of the other nodes.
+            A ``(host, port)`` tuple, or a Unix socket path.
+            There is no authentication, so it must only be reachable
+            by the peers
+        :param peers: A list of the ``listen`` addresses of the other nodes
+        :param log_size: The number of records kept for catching up
+        """
+        self.store = store
+        self.listen = listen
+        self.peers = list(peers)
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.reconnect_delay = reconnect_delay
+
+        # each worker is a separate origin
+        self.node_id = os.urandom(8).hex()
+        self.seq = 0
+        self.log = deque(maxlen=log_size)
+        self.applied = {}  # {origin: seq}
+        self.versions = OrderedDict()  # {session_id: ts}, bounded
+        self.versions_size = log_size * 10
+        self._events = []
+        self._tasks = []
+        self._connections = set()
+        self._server = None
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+    async def start(self, loop):
+        await maybe_await(self.store.start(loop))
+
+        if self.listen:
+            try:
+                await self._listen()
+            except OSError as exc:
+                if exc.errno != errno.EADDRINUSE:
+                    raise
+
+                # another worker of this node listens
+                self._tasks.append(loop.create_task(self._listen_forever()))
+
+        for peer in self.peers:
+            event = asyncio.Event()
+            self._events.append(event)
+            self._tasks.append(loop.create_task(self._send_forever(peer,
+                                                                   event)))
+
+    async def _listen(self):
+        if isinstance(self.listen, str):
+            # start_unix_server() would replace the socket of another worker
+            try:
+                _, writer = await asyncio.open_unix_connection(self.listen)
+            except OSError:
+                pass  # none, or a stale socket file
+            else:
+                writer.close()
+                raise OSError(errno.EADDRINUSE, 'Address already in use',
+                              self.listen)
+
+            self._server = await asyncio.start_unix_server(self._accept,
+                                                           self.listen)
+        else:
+            host, port = self.listen
+            self._server = await asyncio.start_server(self._accept, host,
+                                                      port)
+
+    async def _listen_forever(self):
+        while True:
+            await asyncio.sleep(self.reconnect_delay)
+
+            try:
+                await self._listen()
+                return
+            except OSError as exc:
+                if exc.errno != errno.EADDRINUSE:
+                    raise
+
+    async def stop(self):
+        while self._tasks:
+            self._tasks.pop().cancel()
+
+        self._events.clear()
+
+        if self._server is not None:
+            self._server.close()
+            tasks = list(self._connections)
+
+            for task in tasks:
+                task.cancel()
+
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+
+        await maybe_await(self.store.stop())
+
+    def _version(self, session_id, ts):
+        # last-writer-wins. returns False if ``ts`` is older
+        if ts < self.versions.get(session_id, 0):
+            return False
+
+        self.versions.pop(session_id, None)
+        self.versions[session_id] = ts
+
+        while len(self.versions) > self.versions_size:
+            self.versions.popitem(last=False)
+
+        return True
+
+    def _publish(self, op, session_id, value=b'', expires=None):
+        ts = time.time()
+        self.seq += 1
+
+        if op != OP_TOUCH:
+            self._version(session_id, ts)
+
+        self.log.append((op, self.seq, ts, session_id, value, expires))
+
+        for event in self._events:
+            event.set()
+
+    async def _published(self, result, *args):
+        result = await result
+        self._publish(*args)
+
+        return result
+
+    def exists(self, session_id):
+        return self.store.exists(session_id)
+
+    def get(self, session_id):
+        return self.store.get(session_id)
+
+    def set(self, session_id, value, expires=None):
+        result = self.store.set(session_id, value, expires)
+
+        if isawaitable(result):
+            return self._published(result, OP_SET, session_id, value, expires)
+
+        self._publish(OP_SET, session_id, value, expires)
+        return result
+
+    def delete(self, session_id):
+        result = self.store.delete(session_id)
+
+        if isawaitable(result):
+            return self._published(result, OP_DELETE, session_id)
+
+        self._publish(OP_DELETE, session_id)
+        return result
+
+    def touch(self, session_id, expires=None):
+        result = self.store.touch(session_id, expires)
+
+        if isawaitable(result):
+            return self._published(result, OP_TOUCH, session_id, b'',
+                                   expires)
+
+        self._publish(OP_TOUCH, session_id, b'', expires)
+        return result
+
+    def keys(self):
+        return self.store.keys()
+
+    def expiry(self, session_id):
+        return self.store.expiry(session_id)
+
+    def version(self, session_id):
+        return self.store.version(session_id)
+
+    async def _send_forever(self, peer, event):
+        while True:
+            writer = None
+
+            try:
+                reader, writer = await open_connection(peer)
+                await self._send(reader, writer, event)
+            except (OSError, EOFError, asyncio.IncompleteReadError):
+                pass
+            finally:
+                if writer is not None:
+                    writer.close()
+
+            await asyncio.sleep(self.reconnect_delay)
+
+    async def _resync(self, writer):
+        count = 0
+
+        for session_id in list(await maybe_await(self.store.keys())):
+            value = await maybe_await(self.store.get(session_id))
+
+            if value is not None:
+                # seq and ts 0: never overrides newer writes
+                writer.write(pack_record(
+                    OP_SET, 0, 0, session_id, value,
+                    await maybe_await(self.store.expiry(session_id))
+                ))
+                count += 1
+
+                if count % self.batch_size == 0:
+                    await writer.drain()
+
+    async def _send(self, reader, writer, event):
+        writer.write(pack_frame(OP_HELLO + self.node_id.encode('latin-1')))
+        await writer.drain()
+
+        last, = _SEQ.unpack(await reader.readexactly(_SEQ.size))
+
+        while True:
+            event.clear()
+
+            if self.log and last < self.log[0][1] - 1:
+                # the peer has missed the records that are no longer in
+                # the log. e.g. on connect, or the log has moved on while
+                # waiting for a slow peer
+                last = self.log[0][1] - 1
+                await self._resync(writer)
+                continue
+
+            if not self.log or last >= self.log[-1][1]:
+                await event.wait()
+                await asyncio.sleep(self.batch_delay)
+                continue
+
+            start = last - self.log[0][1] + 1
+
+            for op, seq, ts, session_id, value, expires in islice(
+                    self.log, start, start + self.batch_size):
+                writer.write(
+                    pack_record(op, seq, ts, session_id, value, expires)
+                )
+                last = seq
+
+            await writer.drain()
+
+    def _accept(self, reader, writer):
+        task = asyncio.ensure_future(self._handle(reader, writer))
+        self._connections.add(task)
+        task.add_done_callback(self._connections.discard)
+
+    async def _handle(self, reader, writer):
+        try:
+            payload = await read_frame(reader)
+
+            if payload[:1] != OP_HELLO:
+                return
+
+            origin = payload[1:].decode('latin-1')
+            writer.write(_SEQ.pack(self.applied.get(origin, 0)))
+            await writer.drain()
+
+            while True:
+                op, seq, ts, session_id, value, expires = unpack_record(
+                    await read_frame(reader)
+                )
+
+                if op == OP_TOUCH:
+                    # renews without writing, doesn't take part in
+                    # last-writer-wins
+                    await maybe_await(self.store.touch(session_id, expires))
+                elif self._version(session_id, ts):
+                    if op == OP_SET:
+                        await maybe_await(
+                            self.store.set(session_id, value, expires)
+                        )
+                    elif op == OP_DELETE:
+                        await maybe_await(self.store.delete(session_id))
+
+                if seq:
+                    self.applied[origin] = seq
+        except (OSError, EOFError, ValueError, struct.error,
+                asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,1428 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2023 Anggit Arfanto
+
+import asyncio
+import hashlib
+import heapq
+import json
+import logging
+import math
+import os
+import time
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from inspect import isawaitable, iscoroutinefunction
+
+from . import inotify
+from .bloom import BloomFilter
+from .utils import maybe_await
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+WRITE_THROUGH = 'write-through'
+WRITE_BACK = 'write-back'
+WRITE_AROUND = 'write-around'
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class Store:
+    """Base class for session stores.
+
+    A store maps a session id (a hex string) to the serialized session
+    (bytes). Any of the methods may also be a coroutine function,
+    the middleware will await the result when needed.
+
+    Errors in the background tasks are reported to ``Store.logger``,
+    which is the worker's logger once the middleware has started.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    def start(self, loop):
+        pass
+
+    def stop(self):
+        pass
+
+    def exists(self, session_id):
+        raise NotImplementedError
+
+    def get(self, session_id):
+        raise NotImplementedError
+
+    def set(self, session_id, value, expires=None):
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+    def keys(self):
+        raise NotImplementedError
+
+    def expiry(self, session_id):
+        # the expiration time of a session, or None if it's not recorded
+        return None
+
+    def touch(self, session_id, expires=None):
+        # renew a session without rewriting it. nothing to do for
+        # the stores that don't record the expiration time
+        return None
+
+    def version(self, session_id):
+        # a value that changes whenever the session is written,
+        # or None if it can't be told cheaper than a get()
+        return None
+
+
+def get_volumes(path):
+    if isinstance(path, str):
+        return [(path, 1)]
+
+    if isinstance(path, dict):
+        return list(path.items())
+
+    return [(v, 1) for v in path]
+
+
+def place(session_id, volumes):
+    """Choose a volume for the session id by weighted rendezvous hashing.
+
+    Adding or removing a volume only moves the sessions that land on,
+    or were on, that volume.
+    """
+    if len(volumes) == 1:
+        return volumes[0][0]
+
+    key = b'\x00' + session_id.encode('latin-1')
+    best_score = 0
+    best_path = None
+
+    for path, weight in volumes:
+        h = int.from_bytes(
+            hashlib.blake2b(path.encode('utf-8') + key,
+                            digest_size=8).digest(),
+            'big'
+        )
+        score = -weight / math.log((h + 0.5) / 18446744073709551616)
+
+        if best_path is None or score > best_score:
+            best_score = score
+            best_path = path
+
+    return best_path
+
+
+class FileStore(Store):
+    def __init__(self, path, max_sessions=0, max_bytes=0, evict_interval=10,
+                 previous=None):
+        """Store sessions as files in a directory.
+
+        :param path: The directory path. Or a list of directories,
+            or a dict of ``{directory: weight}``, to spread sessions across
+            several volumes
+        :param max_sessions: The maximum number of session files, 0 means
+            unlimited
+        :param max_bytes: The maximum total size of session files,
+            0 means unlimited
+        :param evict_interval: How often, in seconds, the directory is
+            checked against the limits. The least recently used sessions
+            are evicted in the background, by one worker at a time, and
+            out of the event loop
+        :param previous: The former ``path`` when the volumes are changed.
+            Sessions are moved to their new volumes in the background,
+            meanwhile lookups fall back to the former placement
+        """
+        self.volumes = get_volumes(path)
+        self.path = self.volumes[0][0]
+        self.previous = previous and get_volumes(previous)
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.evict_interval = evict_interval
+
+        # last access times, written back to the files' mtime on eviction
+        self._atimes = {} if max_sessions or max_bytes else None
+        self._lock_fd = None
+        self._tasks = []
+
+    def filepath(self, session_id, volumes=None):
+        return os.path.join(place(session_id, volumes or self.volumes),
+                            session_id)
+
+    def _paths(self):
+        paths = [path for path, _ in self.volumes]
+
+        for path, _ in self.previous or ():
+            if path not in paths:
+                paths.append(path)
+
+        return paths
+
+    def _is_evictor(self):
+        # the worker that holds a lock on the first volume evicts for all
+        if fcntl is None or self._lock_fd is not None:
+            return True
+
+        fd = os.open(self.path, os.O_RDONLY)
+
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+
+        self._lock_fd = fd
+        return True
+
+    async def _evict_forever(self):
+        while True:
+            await asyncio.sleep(self.evict_interval)
+
+            try:
+                await self._write_atimes()
+
+                if self._is_evictor():
+                    await self.evict()
+            except Exception as exc:
+                self.logger.error('FileStore: eviction failed: %r', exc)
+
+    def start(self, loop):
+        if self._atimes is not None:
+            self._tasks.append(loop.create_task(self._evict_forever()))
+
+        if self.previous:
+            self._tasks.append(loop.create_task(self.rebalance()))
+
+    def stop(self):
+        while self._tasks:
+            self._tasks.pop().cancel()
+
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    async def rebalance(self):
+        """Move the sessions that are not on their volume."""
+        i = 0
+
+        for path in self._paths():
+            with os.scandir(path) as it:
+                for entry in it:
+                    i += 1
+
+                    if i % 256 == 0:
+                        await asyncio.sleep(0)
+
+                    if not entry.is_file():
+                        continue
+
+                    filepath = self.filepath(entry.name)
+
+                    if entry.path != filepath:
+                        try:
+                            self._move(entry.path, filepath)
+                        except FileNotFoundError:
+                            pass
+
+        self.previous = None
+
+    def _move(self, src, dst):
+        try:
+            os.replace(src, dst)
+        except OSError as exc:
+            if isinstance(exc, FileNotFoundError):
+                raise
+
+            # across file systems
+            with open(src, 'rb') as fp:
+                value = fp.read()
+
+            with open(dst, 'wb') as fp:
+                fp.write(value)
+
+            os.unlink(src)
+
+    def _scan(self):
+        entries = []
+
+        for path in self._paths():
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_file():
+                            st = entry.stat()
+                            entries.append(
+                                (st.st_mtime, st.st_size, entry.path)
+                            )
+                    except FileNotFoundError:  # deleted meanwhile
+                        pass
+
+        return entries
+
+    async def recent(self, limit):
+        """Return up to ``limit`` session ids, most recently used first."""
+        entries = await asyncio.get_event_loop().run_in_executor(
+            None, self._scan
+        )
+
+        return [os.path.basename(filepath) for _, _, filepath in
+                heapq.nlargest(limit, entries)]
+
+    async def _write_atimes(self):
+        atimes, self._atimes = self._atimes, {}
+
+        for i, (session_id, ts) in enumerate(atimes.items()):
+            try:
+                os.utime(self.filepath(session_id), (ts, ts))
+            except FileNotFoundError:
+                pass
+
+            if i % 256 == 255:
+                await asyncio.sleep(0)
+
+    async def evict(self):
+        """Evict the least recently used sessions until the directory is
+        below 90% of the limits. The directory is scanned in the default
+        executor.
+        """
+        await self._write_atimes()
+        await asyncio.get_event_loop().run_in_executor(None, self._evict)
+
+    def _evict(self):
+        entries = self._scan()
+        total_bytes = sum(size for _, size, _ in entries)
+        count = len(entries)
+
+        if not (self.max_sessions and count > self.max_sessions or
+                self.max_bytes and total_bytes > self.max_bytes):
+            return
+
+        max_sessions = (self.max_sessions and
+                        max(int(self.max_sessions * 0.9), 1) or count)
+        max_bytes = (self.max_bytes and
+                     max(int(self.max_bytes * 0.9), 1) or total_bytes)
+
+        heapq.heapify(entries)
+
+        while entries and (count > max_sessions or total_bytes > max_bytes):
+            _, size, filepath = heapq.heappop(entries)
+
+            try:
+                os.unlink(filepath)
+            except FileNotFoundError:
+                pass
+
+            count -= 1
+            total_bytes -= size
+
+    def exists(self, session_id):
+        if os.path.exists(self.filepath(session_id)):
+            return True
+
+        return bool(self.previous) and os.path.exists(
+            self.filepath(session_id, self.previous)
+        )
+
+    def get(self, session_id):
+        filepath = self.filepath(session_id)
+
+        try:
+            with open(filepath, 'rb') as fp:
+                value = fp.read()
+        except FileNotFoundError:
+            if not self.previous:
+                return None
+
+            # still on its former volume
+            try:
+                self._move(self.filepath(session_id, self.previous), filepath)
+            except FileNotFoundError:
+                return None
+
+            return self.get(session_id)
+
+        if self._atimes is not None:
+            self._atimes[session_id] = time.time()
+
+        return value
+
+    def version(self, session_id):
+        try:
+            st = os.stat(self.filepath(session_id))
+        except FileNotFoundError:
+            return None
+
+        now = time.time()
+
+        if now - st.st_mtime < 1:
+            # too recent, timestamps may be too coarse
+            # to tell apart two writes of the same size
+            return None
+
+        if self._atimes is not None:
+            self._atimes[session_id] = now
+
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def set(self, session_id, value, expires=None):
+        with open(self.filepath(session_id), 'wb') as fp:
+            fp.write(value)
+
+        if self._atimes is not None:
+            self._atimes.pop(session_id, None)
+
+    def delete(self, session_id):
+        for volumes in (self.volumes, self.previous):
+            if volumes:
+                try:
+                    os.unlink(self.filepath(session_id, volumes))
+                except FileNotFoundError:
+                    pass
+
+    def keys(self):
+        for path in self._paths():
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        yield entry.name
+
+
+class MemoryStore(Store):
+    def __init__(self, max_sessions=0, max_bytes=0, snapshot=None,
+                 snapshot_interval=60, cleanup_interval=10):
+        """Store sessions in the process memory.
+
+        :param max_sessions: The maximum number of sessions, 0 means
+            unlimited
+        :param max_bytes: The maximum total size of the session values,
+            0 means unlimited. The least recently used sessions are evicted
+            first
+        :param snapshot: A file to save the sessions to, periodically and
+            on stop. It is loaded on start, so restarts keep the sessions.
+            Each process needs its own file
+        :param snapshot_interval: In seconds. 0 saves only on stop
+        :param cleanup_interval: How often, in seconds, the expired sessions
+            are removed
+        """
+        # {binary id: (value, expires, version)}
+        self.data = OrderedDict()
+        self.expiries = []  # heap of (expires, binary id)
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.writes = 0
+        self.snapshot = snapshot
+        self.snapshot_interval = snapshot_interval
+        self.cleanup_interval = cleanup_interval
+        self._tasks = []
+
+    async def _cleanup_forever(self):
+        while True:
+            await asyncio.sleep(self.cleanup_interval)
+            self.cleanup()
+
+    async def _save_forever(self):
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+
+            try:
+                self.save()
+            except OSError:
+                pass
+
+    def start(self, loop):
+        if self.snapshot and os.path.exists(self.snapshot):
+            self.load()
+
+        if self.cleanup_interval > 0:
+            self._tasks.append(loop.create_task(self._cleanup_forever()))
+
+        if self.snapshot and self.snapshot_interval > 0:
+            self._tasks.append(loop.create_task(self._save_forever()))
+
+    def stop(self):
+        while self._tasks:
+            self._tasks.pop().cancel()
+
+        if self.snapshot:
+            self.save()
+
+    def exists(self, session_id):
+        return self.get(session_id) is not None
+
+    def get(self, session_id):
+        key = bytes.fromhex(session_id)
+
+        try:
+            value, expires, _ = self.data[key]
+        except KeyError:
+            return None
+
+        if expires and time.time() > expires:
+            self._pop(key)
+            return None
+
+        self.data.move_to_end(key)
+        return value
+
+    def _expire_at(self, key, expires):
+        heapq.heappush(self.expiries, (expires, key))
+
+        if len(self.expiries) > 2 * len(self.data) + 64:
+            # drop the entries of overwritten and deleted sessions
+            self.expiries = [(expires, key) for key, (_, expires, _)
+                             in self.data.items() if expires]
+            heapq.heapify(self.expiries)
+
+    def set(self, session_id, value, expires=None):
+        key = bytes.fromhex(session_id)
+        self._pop(key)
+
+        self.writes += 1
+        self.data[key] = (value, expires, self.writes)
+        self.bytes += len(value)
+
+        if expires:
+            self._expire_at(key, expires)
+
+        while (self.max_sessions and len(self.data) > self.max_sessions or
+               self.max_bytes and self.bytes > self.max_bytes):
+            _, (value, *_) = self.data.popitem(last=False)
+            self.bytes -= len(value)
+
+    def touch(self, session_id, expires=None):
+        """Renew a session without rewriting it.
+
+        Returns False if the session does not exist.
+        """
+        if self.get(session_id) is None:
+            return False
+
+        key = bytes.fromhex(session_id)
+        value, _, version = self.data[key]
+        self.data[key] = (value, expires, version)
+
+        if expires:
+            self._expire_at(key, expires)
+
+        return True
+
+    def _pop(self, key):
+        item = self.data.pop(key, None)
+
+        if item is not None:
+            self.bytes -= len(item[0])
+
+    def delete(self, session_id):
+        self._pop(bytes.fromhex(session_id))
+
+    def keys(self):
+        return [key.hex() for key in self.data]
+
+    def expiry(self, session_id):
+        item = self.data.get(bytes.fromhex(session_id))
+        return item and item[1]
+
+    def version(self, session_id):
+        key = bytes.fromhex(session_id)
+        item = self.data.get(key)
+
+        if item is None or item[1] and time.time() > item[1]:
+            return None
+
+        self.data.move_to_end(key)
+        return item[2]
+
+    def cleanup(self):
+        """Remove the expired sessions. Returns the number of sessions
+        removed.
+        """
+        now = time.time()
+        count = 0
+
+        while self.expiries and self.expiries[0][0] < now:
+            expires, key = heapq.heappop(self.expiries)
+            item = self.data.get(key)
+
+            # the entry is stale if the session was renewed
+            if item is not None and item[1] == expires:
+                self._pop(key)
+                count += 1
+
+        return count
+
+    def clear(self):
+        self.data.clear()
+        self.expiries.clear()
+        self.bytes = 0
+
+    def save(self, path=None):
+        """Write the sessions to ``path``, or to the snapshot file,
+        atomically. The format is the one of ``migrate.export()``.
+        """
+        path = path or self.snapshot
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        now = time.time()
+
+        try:
+            with open(tmp_path, 'w') as fp:
+                # least recently used first, like ``self.data``
+                for key, (value, expires, _) in self.data.items():
+                    if expires and now > expires:
+                        continue
+
+                    fp.write(json.dumps({'id': key.hex(),
+                                         'expires': expires,
+                                         'value': value.decode('utf-8')}) +
+                             '\n')
+
+                fp.flush()
+                os.fsync(fp.fileno())
+
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+
+            raise
+
+    def load(self, path=None):
+        """Read the sessions written by ``save()``.
+
+        Returns the number of sessions loaded.
+        """
+        count = 0
+        now = time.time()
+
+        with open(path or self.snapshot, 'r') as fp:
+            for line in fp:
+                if not line.strip():
+                    continue
+
+                item = json.loads(line)
+
+                if item['expires'] and now > item['expires']:
+                    continue
+
+                self.set(item['id'], item['value'].encode('utf-8'),
+                         item['expires'])
+                count += 1
+
+        return count
+
+
+class TieredStore(Store):
+    def __init__(self, *tiers, flush_interval=1, warm_up=0, warm_up_bytes=0,
+                 warm_up_timeout=10, hot_ids=None, watch=False,
+                 promote_ttl=1800):
+        """Compose stores as tiers, from the fastest to the authoritative.
+
+        Reads fall through the tiers and promote the entry to the upper
+        tiers. Writes follow the policy of each tier:
+
+        - ``'write-through'``, the tier is written on every save
+        - ``'write-back'``, the tier is written by a background flush
+        - ``'write-around'``, the tier is only filled on reads
+
+        :param tiers: Store objects, or ``(store, policy)`` tuples.
+            The default policy is ``'write-through'``
+        :param flush_interval: How often, in seconds, the pending
+            ``'write-back'`` entries are flushed
+        :param warm_up: The number of the most recently used sessions
+            to load into the first tier, in the background, at worker start.
+            0 means disabled
+        :param warm_up_bytes: Stop the warm-up after loading this many bytes.
+            0 means unlimited
+        :param warm_up_timeout: Stop the warm-up after this many seconds
+        :param hot_ids: A file path where the ids in the first tier are
+            written on shutdown. They are loaded first on the next warm-up.
+            Otherwise the most recent sessions are taken from the lower tiers
+            that have a ``recent()`` method, e.g. ``FileStore``
+        :param watch: On Linux, watch the directories of the ``FileStore``
+            tiers with inotify, and drop the entries in the upper tiers when
+            their files are modified or deleted by other processes.
+            This keeps per-worker caches correct without a stat on every hit
+        :param promote_ttl: The expiration time, in seconds from now,
+            of the entries promoted from a tier that doesn't record one,
+            e.g. ``FileStore``. So that the upper tiers don't keep them
+            forever
+        """
+        self.tiers = []
+
+        for tier in tiers:
+            if isinstance(tier, tuple):
+                store, policy = tier
+            else:
+                store, policy = tier, WRITE_THROUGH
+
+            if policy not in (WRITE_THROUGH, WRITE_BACK, WRITE_AROUND):
+                raise ValueError('unknown write policy: %s' % policy)
+
+            # pending writes of a write-back tier. None means delete
+            self.tiers.append((store, policy, {}))
+
+        if not self.tiers or self.tiers[-1][1] == WRITE_AROUND:
+            raise ValueError('the last tier must not be write-around')
+
+        self.flush_interval = flush_interval
+        self.warm_up = warm_up
+        self.warm_up_bytes = warm_up_bytes
+        self.warm_up_timeout = warm_up_timeout
+        self.hot_ids = hot_ids
+        self.watch = watch
+        self.promote_ttl = promote_ttl
+        self._tasks = []
+        self._watcher = None
+        self._watched = {}  # {directory: tier}
+
+        # {tier: {session_id: value}}, own writes that are yet to be seen
+        # by the watcher
+        self._writes = {}
+
+    async def _flush_forever(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+
+            try:
+                await self.flush()
+            except Exception as exc:
+                # kept pending, retried on the next flush
+                self.logger.error('TieredStore: flush failed: %r', exc)
+
+    async def start(self, loop):
+        for store, *_ in self.tiers:
+            await maybe_await(store.start(loop))
+
+        if any(policy == WRITE_BACK for _, policy, _ in self.tiers):
+            self._tasks.append(loop.create_task(self._flush_forever()))
+
+        if self.warm_up and len(self.tiers) > 1:
+            self._tasks.append(loop.create_task(self.load_recent(loop)))
+
+        if self.watch and inotify.available():
+            for i, (store, *_) in enumerate(self.tiers):
+                if i > 0 and hasattr(store, '_paths'):
+                    self._writes[i] = {}
+
+                    for path in store._paths():
+                        self._watched[path] = i
+
+            if self._watched:
+                self._watcher = inotify.Watcher(self._on_change)
+                self._watcher.start(loop, list(self._watched))
+
+    async def stop(self):
+        while self._tasks:
+            self._tasks.pop().cancel()
+
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
+
+        await self.flush()
+
+        if self.hot_ids:
+            try:
+                self._save_hot_ids(
+                    await maybe_await(self.tiers[0][0].keys())
+                )
+            except OSError:
+                pass
+
+        for store, *_ in reversed(self.tiers):
+            await maybe_await(store.stop())
+
+    def _load_hot_ids(self):
+        ids = []
+
+        try:
+            with open(self.hot_ids, 'r') as fp:
+                for session_id in fp.read().split():
+                    try:
+                        bytes.fromhex(session_id)
+                    except ValueError:
+                        continue
+
+                    ids.append(session_id)
+        except FileNotFoundError:
+            pass
+
+        return ids
+
+    def _save_hot_ids(self, keys):
+        # keys are in LRU order, the most recent last.
+        # other workers may have written theirs, keep them after ours
+        ids = list(dict.fromkeys(
+            list(reversed(list(keys))) + self._load_hot_ids()
+        ))[:self.warm_up or None]
+        tmp = '%s.%d' % (self.hot_ids, os.getpid())
+
+        with open(tmp, 'w') as fp:
+            fp.write('\n'.join(ids))
+
+        os.replace(tmp, self.hot_ids)
+
+    async def load_recent(self, loop):
+        """Load the most recently used sessions into the first tier, within
+        the ``warm_up*`` budget.
+        """
+        deadline = loop.time() + self.warm_up_timeout
+        top = self.tiers[0][0]
+        ids = self._load_hot_ids() if self.hot_ids else []
+
+        if len(ids) < self.warm_up:
+            for store, *_ in self.tiers[1:]:
+                if hasattr(store, 'recent'):
+                    ids.extend(
+                        await maybe_await(store.recent(self.warm_up))
+                    )
+                    break
+
+        count = 0
+        total_bytes = 0
+
+        for session_id in dict.fromkeys(ids):
+            if (count >= self.warm_up or loop.time() > deadline or
+                    self.warm_up_bytes and total_bytes >= self.warm_up_bytes):
+                break
+
+            for store, _, pending in self.tiers[1:]:
+                if session_id in pending:
+                    break
+
+                value = await maybe_await(store.get(session_id))
+
+                if value is not None:
+                    # don't overwrite what's been written in the meantime
+                    if await maybe_await(top.get(session_id)) is None:
+                        await maybe_await(top.set(
+                            session_id, value, self._expiry(
+                                await maybe_await(store.expiry(session_id))
+                            )
+                        ))
+
+                    count += 1
+                    total_bytes += len(value)
+                    break
+
+            await asyncio.sleep(0)
+
+        return count
+
+    def _on_change(self, path, name, mask):
+        if path is None:  # events were lost
+            for writes in self._writes.values():
+                writes.clear()
+
+            for store, *_ in self.tiers[:max(self._watched.values())]:
+                if hasattr(store, 'clear'):
+                    store.clear()
+
+            for i in set(self._watched.values()):
+                if isinstance(self.tiers[i][0], BloomFilterStore):
+                    # the files created meanwhile are not in the filter
+                    self.tiers[i][0]._schedule_rebuild()
+
+            return
+
+        try:
+            bytes.fromhex(name)
+        except ValueError:
+            return  # not a session, e.g. a temporary file
+
+        i = self._watched[path]
+        writes = self._writes[i]
+        own = writes.pop(name, None)
+
+        if mask & (inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO):
+            if isinstance(self.tiers[i][0], BloomFilterStore):
+                self.tiers[i][0].add(name)
+
+            # identical events are merged by inotify, so they can't be
+            # counted. the cached entry is still valid if the file holds
+            # what was written last. timestamps are too coarse to tell
+            if own is not None and own == self._read(
+                    os.path.join(path, name)):
+                return
+
+        for store, *_ in self.tiers[:i]:
+            result = store.delete(name)
+
+            if isawaitable(result):
+                asyncio.ensure_future(result)
+
+    def _read(self, filepath):
+        try:
+            with open(filepath, 'rb') as fp:
+                return fp.read()
+        except OSError:
+            return None
+
+    async def _write(self, i, session_id, value, expires):
+        await maybe_await(self.tiers[i][0].set(session_id, value, expires))
+
+        if i in self._writes:
+            self._writes[i][session_id] = value
+
+    async def flush(self):
+        for i, (store, _, pending) in enumerate(self.tiers):
+            while pending:
+                session_id, item = pending.popitem()
+
+                try:
+                    if item is None:
+                        await maybe_await(store.delete(session_id))
+                    else:
+                        await self._write(i, session_id, *item)
+                except BaseException:
+                    # unless it has been rewritten meanwhile
+                    pending.setdefault(session_id, item)
+                    raise
+
+    async def exists(self, session_id):
+        for store, _, pending in self.tiers:
+            if session_id in pending:
+                return pending[session_id] is not None
+
+            if await maybe_await(store.exists(session_id)):
+                return True
+
+        return False
+
+    async def get(self, session_id):
+        for i, (store, _, pending) in enumerate(self.tiers):
+            if session_id in pending:
+                if pending[session_id] is None:
+                    return None
+
+                value = pending[session_id][0]
+            else:
+                value = await maybe_await(store.get(session_id))
+
+            if value is not None:
+                if session_id in pending:
+                    expires = self._expiry(pending[session_id][1])
+                else:
+                    expires = self._expiry(
+                        await maybe_await(store.expiry(session_id))
+                    )
+
+                # promote to the upper tiers
+                for upper, *_ in self.tiers[:i]:
+                    await maybe_await(upper.set(session_id, value, expires))
+
+                return value
+
+    def _expiry(self, expires):
+        # the expiration time of a promoted entry
+        if expires is None and self.promote_ttl:
+            return time.time() + self.promote_ttl
+
+        return expires
+
+    async def set(self, session_id, value, expires=None):
+        for i, (store, policy, pending) in enumerate(self.tiers):
+            if policy == WRITE_THROUGH:
+                await self._write(i, session_id, value, expires)
+            elif policy == WRITE_BACK:
+                pending[session_id] = (value, expires)
+            else:
+                await maybe_await(store.delete(session_id))
+
+    async def delete(self, session_id):
+        for store, policy, pending in self.tiers:
+            if policy == WRITE_BACK:
+                pending[session_id] = None
+            else:
+                await maybe_await(store.delete(session_id))
+
+    async def touch(self, session_id, expires=None):
+        for store, _, pending in self.tiers:
+            if session_id in pending:
+                if pending[session_id] is not None:
+                    pending[session_id] = (pending[session_id][0], expires)
+            else:
+                await maybe_await(store.touch(session_id, expires))
+
+    async def version(self, session_id):
+        store, policy, pending = self.tiers[0]
+
+        if policy != WRITE_THROUGH or session_id in pending:
+            return None
+
+        return await maybe_await(store.version(session_id))
+
+    async def keys(self):
+        store, _, pending = self.tiers[-1]
+        keys = set(await maybe_await(store.keys()))
+        keys.update(pending)
+
+        return [k for k in keys if pending.get(k, k) is not None]
+
+    def expiry(self, session_id):
+        return self.tiers[-1][0].expiry(session_id)
+
+    async def invalidate(self, session_id=None, tier=0):
+        """Drop entries from a single tier without touching the others.
+
+        :param session_id: The session id. If omitted, the whole tier is
+            cleared. The tier must have a ``clear()`` method
+        :param tier: The tier index
+        """
+        store, _, pending = self.tiers[tier]
+
+        if session_id is None:
+            pending.clear()
+            await maybe_await(store.clear())
+        else:
+            pending.pop(session_id, None)
+            await maybe_await(store.delete(session_id))
+
+
+class BloomFilterStore(Store):
+    def __init__(self, store, capacity=100000, error_rate=0.01):
+        """Answer lookups of non-existent session ids without touching
+        the underlying store.
+
+        The filter is built from ``store.keys()`` at worker start.
+        It is per-worker, so it's only safe if other processes don't
+        create sessions in the same store, e.g. with a single worker.
+        As a tier of ``TieredStore(..., watch=True)``, the files created
+        by other processes are added when their events are read. But
+        a request can reach a worker before that, and miss the session.
+
+        :param store: The store to wrap
+        :param capacity: The expected number of sessions
+        :param error_rate: The false positive rate of the filter
+        """
+        self.store = store
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bloom = None  # pass through until the filter is built
+        self.deleted = 0
+        self._building = None
+        self._loop = None
+        self._task = None
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+    async def start(self, loop):
+        self._loop = loop
+
+        await maybe_await(self.store.start(loop))
+        await self.rebuild()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        await maybe_await(self.store.stop())
+
+    async def rebuild(self):
+        # the ids added meanwhile, keys() may not have seen them
+        added = self._building = set()
+
+        try:
+            keys = list(await maybe_await(self.store.keys()))
+
+            # sized from the sessions that actually exist, with room to grow
+            bloom = BloomFilter(max(self.capacity, len(keys) * 2),
+                                self.error_rate)
+
+            for i, key in enumerate(keys):
+                bloom.add(key)
+
+                if i % 1000 == 999:
+                    await asyncio.sleep(0)
+
+            for key in added:
+                bloom.add(key)
+        finally:
+            if self._building is added:
+                self._building = None
+
+        self.bloom = bloom
+        self.deleted = 0
+
+    def _schedule_rebuild(self):
+        if self._loop is not None and (self._task is None or
+                                       self._task.done()):
+            self._task = self._loop.create_task(self.rebuild())
+
+    def add(self, session_id):
+        if self.bloom is not None:
+            self.bloom.add(session_id)
+
+            if len(self.bloom) > self.bloom.capacity:
+                self._schedule_rebuild()
+
+        if self._building is not None:
+            self._building.add(session_id)
+
+    def __contains__(self, session_id):
+        return self.bloom is None or session_id in self.bloom
+
+    def exists(self, session_id):
+        if session_id not in self:
+            return False
+
+        return self.store.exists(session_id)
+
+    def get(self, session_id):
+        if session_id not in self:
+            return None
+
+        return self.store.get(session_id)
+
+    def set(self, session_id, value, expires=None):
+        self.add(session_id)
+        return self.store.set(session_id, value, expires)
+
+    def delete(self, session_id):
+        if session_id not in self:
+            return None
+
+        # a Bloom filter can't forget, stale bits are dropped on rebuild
+        self.deleted += 1
+
+        if self.bloom is not None and self.deleted > self.bloom.capacity // 2:
+            self._schedule_rebuild()
+
+        return self.store.delete(session_id)
+
+    def keys(self):
+        return self.store.keys()
+
+    def expiry(self, session_id):
+        return self.store.expiry(session_id)
+
+    def touch(self, session_id, expires=None):
+        if session_id not in self:
+            return None
+
+        return self.store.touch(session_id, expires)
+
+    def version(self, session_id):
+        if session_id not in self:
+            return None
+
+        return self.store.version(session_id)
+
+
+class MigrationStore(Store):
+    def __init__(self, old, new):
+        """Read from and write to both stores while migrating to ``new``.
+
+        Reads try ``new`` first and fall back to ``old``, copying the entry
+        over. Writes and deletes go to both. Once the remaining sessions
+        have been copied, e.g. with ``python3 -m tremolo_session copy``,
+        ``old`` can be dropped.
+        """
+        self.old = old
+        self.new = new
+
+    def __getattr__(self, name):
+        return getattr(self.new, name)
+
+    async def start(self, loop):
+        await maybe_await(self.old.start(loop))
+        await maybe_await(self.new.start(loop))
+
+    async def stop(self):
+        await maybe_await(self.new.stop())
+        await maybe_await(self.old.stop())
+
+    async def exists(self, session_id):
+        return (await maybe_await(self.new.exists(session_id)) or
+                await maybe_await(self.old.exists(session_id)))
+
+    async def get(self, session_id):
+        value = await maybe_await(self.new.get(session_id))
+
+        if value is None:
+            value = await maybe_await(self.old.get(session_id))
+
+            if value is not None:
+                await maybe_await(self.new.set(
+                    session_id,
+                    value,
+                    await maybe_await(self.old.expiry(session_id))
+                ))
+
+        return value
+
+    async def set(self, session_id, value, expires=None):
+        await maybe_await(self.new.set(session_id, value, expires))
+        await maybe_await(self.old.set(session_id, value, expires))
+
+    async def delete(self, session_id):
+        await maybe_await(self.new.delete(session_id))
+        await maybe_await(self.old.delete(session_id))
+
+    async def touch(self, session_id, expires=None):
+        await maybe_await(self.new.touch(session_id, expires))
+        await maybe_await(self.old.touch(session_id, expires))
+
+    def keys(self):
+        return self.new.keys()
+
+    def expiry(self, session_id):
+        return self.new.expiry(session_id)
+
+
+class BreakerStore(Store):
+    def __init__(self, store, timeout=1, threshold=5, reset_timeout=10,
+                 buffer_size=1000, cache_size=1000, max_workers=4):
+        """Guard a store with per-operation timeouts and a circuit breaker.
+
+        After ``threshold`` consecutive failures or timeouts, the breaker
+        opens: writes go to a bounded in-memory buffer, which is replayed
+        in the background once the store recovers, and reads are served
+        from the buffer or from a cache of the recently used sessions.
+        After ``reset_timeout`` seconds, one operation is let through
+        to probe the store.
+
+        :param timeout: The time limit, in seconds, of each operation.
+            Synchronous stores are run in a pool of ``max_workers`` threads
+        :param buffer_size: The maximum number of buffered writes. The oldest
+            are dropped first
+        :param cache_size: The number of sessions kept for degraded reads,
+            0 means disabled
+        """
+        self.store = store
+        self.timeout = timeout
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.buffer_size = buffer_size
+        self.max_workers = max_workers
+        self.buffer = OrderedDict()  # {session_id: (value, expires) or None}
+        self.cache = None
+
+        if cache_size:
+            self.cache = MemoryStore(max_sessions=cache_size)
+
+        self.state = CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.dropped = 0
+        self._opened_at = 0
+        self._replaying = False
+        self._replay_task = None
+        self._executor = None
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+    async def start(self, loop):
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+
+        await maybe_await(self.store.start(loop))
+
+    async def stop(self):
+        if self._replay_task is not None:
+            self._replay_task.cancel()
+            self._replay_task = None
+
+        await maybe_await(self.store.stop())
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def health(self):
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'trips': self.trips,
+            'buffered': len(self.buffer),
+            'dropped': self.dropped
+        }
+
+    async def _call(self, name, *args):
+        func = getattr(self.store, name)
+
+        if iscoroutinefunction(func):
+            result = func(*args)
+        else:
+            result = asyncio.get_event_loop().run_in_executor(
+                self._executor, func, *args
+            )
+
+        result = await asyncio.wait_for(result, self.timeout)
+
+        if isawaitable(result):  # e.g. a wrapper of an asynchronous store
+            result = await asyncio.wait_for(result, self.timeout)
+
+        return result
+
+    def _allow(self):
+        if (self.state == OPEN and
+                time.monotonic() - self._opened_at >= self.reset_timeout):
+            self.state = HALF_OPEN
+            return True  # this one is the probe
+
+        return self.state == CLOSED
+
+    def _failure(self):
+        self.failures += 1
+
+        if self.state == HALF_OPEN or self.failures >= self.threshold:
+            if self.state != OPEN:
+                self.trips += 1
+
+            self.state = OPEN
+            self._opened_at = time.monotonic()
+
+    async def _guard(self, name, *args):
+        probe = self.state == HALF_OPEN
+
+        try:
+            result = await self._call(name, *args)
+        except (OSError, asyncio.TimeoutError):
+            self._failure()
+            raise
+        else:
+            self.failures = 0
+
+            if probe:
+                self.state = CLOSED
+        finally:
+            if probe and self.state == HALF_OPEN:
+                # cancelled, or another error. the next operation probes
+                self.state = OPEN
+                self._opened_at = time.monotonic() - self.reset_timeout
+
+        if self.buffer and not self._replaying:
+            # in the background, so that this request doesn't wait for it.
+            # also retries a replay that has been interrupted
+            self._replaying = True
+            self._replay_task = asyncio.get_event_loop().create_task(
+                self.replay()
+            )
+
+        return result
+
+    async def replay(self):
+        self._replaying = True
+
+        try:
+            while self.buffer and self.state == CLOSED:
+                session_id, item = next(iter(self.buffer.items()))
+
+                try:
+                    if item is None:
+                        await self._call('delete', session_id)
+                    else:
+                        await self._call('set', session_id, *item)
+                except (OSError, asyncio.TimeoutError):
+                    self._failure()
+                    return
+                except Exception as exc:
+                    self.logger.error('BreakerStore: replay failed: %r', exc)
+                    return
+
+                # unless it's been written again in the meantime
+                if self.buffer.get(session_id) is item:
+                    del self.buffer[session_id]
+        finally:
+            self._replaying = False
+
+    def _buffer(self, session_id, item):
+        self.buffer.pop(session_id, None)
+        self.buffer[session_id] = item
+
+        while len(self.buffer) > self.buffer_size:
+            self.buffer.popitem(last=False)
+            self.dropped += 1
+
+    async def exists(self, session_id):
+        if session_id in self.buffer:
+            return self.buffer[session_id] is not None
+
+        if self._allow():
+            try:
+                return await self._guard('exists', session_id)
+            except (OSError, asyncio.TimeoutError):
+                pass
+
+        return self.cache is not None and self.cache.exists(session_id)
+
+    async def get(self, session_id):
+        if session_id in self.buffer:
+            item = self.buffer[session_id]
+            return item and item[0]
+
+        if self._allow():
+            try:
+                value = await self._guard('get', session_id)
+            except (OSError, asyncio.TimeoutError):
+                pass
+            else:
+                if self.cache is not None:
+                    if value is None:
+                        self.cache.delete(session_id)
+                    else:
+                        self.cache.set(session_id, value)
+
+                return value
+
+        if self.cache is not None:
+            return self.cache.get(session_id)
+
+    async def set(self, session_id, value, expires=None):
+        if self.cache is not None:
+            self.cache.set(session_id, value, expires)
+
+        if self._allow():
+            self.buffer.pop(session_id, None)
+
+            try:
+                return await self._guard('set', session_id, value, expires)
+            except (OSError, asyncio.TimeoutError):
+                pass
+
+        self._buffer(session_id, (value, expires))
+
+    async def delete(self, session_id):
+        if self.cache is not None:
+            self.cache.delete(session_id)
+
+        if self._allow():
+            self.buffer.pop(session_id, None)
+
+            try:
+                return await self._guard('delete', session_id)
+            except (OSError, asyncio.TimeoutError):
+                pass
+
+        self._buffer(session_id, None)
+
+    async def touch(self, session_id, expires=None):
+        if self.cache is not None:
+            self.cache.touch(session_id, expires)
+
+        item = self.buffer.get(session_id)
+
+        if item is not None:
+            self.buffer[session_id] = (item[0], expires)
+        elif session_id not in self.buffer and self._allow():
+            try:
+                return await self._guard('touch', session_id, expires)
+            except (OSError, asyncio.TimeoutError):
+                pass
+
+    def keys(self):
+        return self.store.keys()
+
+    def expiry(self, session_id):
+        return self.store.expiry(session_id)
@@ -0,0 +1,11 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2023 Anggit Arfanto
+
+from inspect import isawaitable
+
+
+async def maybe_await(value):
+    if isawaitable(value):
+        return await value
+
+    return value